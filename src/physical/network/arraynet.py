@@ -0,0 +1,301 @@
+
+
+# array-backed network: node storage, edge endpoints, capacity & fid in numpy
+# arrays, with a CSR adjacency for routing
+#   indptr   (nodes + 1), the neighbors of node u are indices[indptr[u]:indptr[u+1]]
+#   indices  neighbor node of each adjacency slot
+#   slots    edge id of each adjacency slot
+# nodes are referred to by position, ids maps positions to node ids
+# ArrayNode & ArrayEdge read & write the arrays, so a networkx graph of them
+# shares the storage instead of copying it
+
+
+import heapq
+
+import numpy as np
+
+from .types import NodeID, StaticPath
+
+
+class ArrayNet:
+    """
+    network of n nodes and m undirected edges (src[e], dst[e]) as arrays
+    """
+
+    def __init__(self, ids: np.ndarray, src: np.ndarray, dst: np.ndarray) -> None:
+        """
+        ids: node ids, by position
+        src, dst: endpoint positions of every edge
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        assert self.src.shape == self.dst.shape, 'src and dst must have the same shape'
+
+        n, m = len(self.ids), len(self.src)
+        self.storage = np.zeros(n, dtype=np.int64)
+        self.capacity = np.zeros(m, dtype=np.int64)
+        self.fid = np.ones(m, dtype=np.float64)
+
+        # both directions of every edge, grouped by head
+        heads = np.concatenate([self.src, self.dst])
+        order = np.argsort(heads, kind='stable')
+        self.indices = np.concatenate([self.dst, self.src])[order]
+        self.slots = np.concatenate([np.arange(m), np.arange(m)])[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(heads, minlength=n))
+
+        self._sorted_ids = bool(np.all(self.ids[1:] > self.ids[:-1]))
+        self._pos: 'dict[NodeID, int]' = None
+
+    @classmethod
+    def from_edges(cls, edges, ids=None) -> 'ArrayNet':
+        """
+        edges: (m, 2+) array or iterable of (u, v, ...) node ids
+        ids: all node ids, the ids in edges by default
+        """
+        edges = np.asarray(list(edges) if not isinstance(edges, np.ndarray) else edges)
+        edges = edges.reshape(-1, edges.shape[-1] if edges.ndim > 1 else 2)[:, :2].astype(np.int64)
+        if ids is None:
+            ids = np.unique(edges)
+        ids = np.sort(np.asarray(list(ids), dtype=np.int64))
+        src = np.searchsorted(ids, edges[:, 0])
+        dst = np.searchsorted(ids, edges[:, 1])
+        return cls(ids, src, dst)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.src)
+
+    def pos(self, node: NodeID) -> int:
+        """
+        position of a node id
+        """
+        if self._sorted_ids:
+            k = int(np.searchsorted(self.ids, node))
+            if k < len(self.ids) and self.ids[k] == node:
+                return k
+            raise KeyError(node)
+        if self._pos is None:
+            self._pos = {node: k for k, node in enumerate(self.ids.tolist())}
+        return self._pos[node]
+
+    def generate(self, node_memory=(50, 100), edge_capacity=(26, 35),
+            edge_fidelity=(0.7, 0.95)) -> None:
+        """
+        draw storage, capacity & fid of all nodes and edges at once
+        ranges as in QuNet.net_gen
+        """
+        self.storage[:] = np.random.randint(node_memory[0], node_memory[1], size=self.n_nodes)
+        self.capacity[:] = np.random.randint(edge_capacity[0], edge_capacity[1], size=self.n_edges)
+        self.fid[:] = np.random.uniform(edge_fidelity[0], edge_fidelity[1], size=self.n_edges)
+
+    def neighbors(self, u: int) -> np.ndarray:
+        """
+        neighbor positions of node position u, a view
+        """
+        return self.indices[self.indptr[u]:self.indptr[u + 1]]
+
+    def incident(self, u: int) -> np.ndarray:
+        """
+        ids of the edges of node position u, a view
+        """
+        return self.slots[self.indptr[u]:self.indptr[u + 1]]
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def fid_weight(self, gate, capacity_weight: float=0.0) -> np.ndarray:
+        """
+        edge weights of QuNet.fid_weight as an array, inf for unusable edges
+        """
+        w = np.asarray(gate.swap_weight(self.fid), dtype=np.float64).reshape(self.n_edges)
+        if capacity_weight > 0 and self.n_edges > 0:
+            with np.errstate(divide='ignore'):
+                w = w + capacity_weight * np.log(self.capacity.max() / self.capacity)
+        return w
+
+    def _expand(self, frontier: np.ndarray) -> 'tuple[np.ndarray, np.ndarray]':
+        # (head, slot) of every adjacency slot of the frontier nodes
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = int(counts.sum())
+        heads = np.repeat(frontier, counts)
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return heads, offsets + np.arange(total)
+
+    def bfs(self, source: int, mask: np.ndarray=None) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        hop distance & predecessor slot of every node from position source,
+        -1 if unreachable, a frontier is expanded as one array op
+        mask: usable edges (bool by edge id), all by default
+        """
+        dist = np.full(self.n_nodes, -1, dtype=np.int64)
+        pred = np.full(self.n_nodes, -1, dtype=np.int64)
+        dist[source] = 0
+        frontier = np.array([source], dtype=np.int64)
+        level = 0
+        while len(frontier) > 0:
+            level += 1
+            _, slots = self._expand(frontier)
+            if mask is not None:
+                slots = slots[mask[self.slots[slots]]]
+            nbrs = self.indices[slots]
+            new = dist[nbrs] < 0
+            nbrs, slots = nbrs[new], slots[new]
+            # first slot reaching a node is its predecessor
+            frontier, first = np.unique(nbrs, return_index=True)
+            dist[frontier] = level
+            pred[frontier] = slots[first]
+        return dist, pred
+
+    def dijkstra(self, source: int, weight: np.ndarray, target: int=None,
+            mask: np.ndarray=None) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        distance & predecessor slot of every node from position source
+        weight: non-negative weight by edge id, inf for unusable edges
+        target: stop once it is settled
+        """
+        usable = np.isfinite(weight)
+        if mask is not None:
+            usable &= mask
+        # per-slot weights, plain lists are faster to index in the loop
+        slot_w = np.where(usable[self.slots], weight[self.slots], np.inf).tolist()
+        indptr, indices = self.indptr.tolist(), self.indices.tolist()
+        inf = float('inf')
+        dist = [inf] * self.n_nodes
+        pred = [-1] * self.n_nodes
+        done = [False] * self.n_nodes
+
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while len(heap) > 0:
+            d, u = heapq.heappop(heap)
+            if done[u]:
+                continue
+            done[u] = True
+            if u == target:
+                break
+            for s in range(indptr[u], indptr[u + 1]):
+                nd = d + slot_w[s]
+                v = indices[s]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = s
+                    heapq.heappush(heap, (nd, v))
+        return np.array(dist), np.array(pred, dtype=np.int64)
+
+    def trace(self, pred: np.ndarray, source: int, target: int) -> np.ndarray:
+        """
+        edge ids of the path from source to target, None if unreachable
+        """
+        if target != source and pred[target] < 0:
+            return None
+        path = []
+        v = target
+        while v != source:
+            e = int(self.slots[pred[v]])
+            path.append(e)
+            v = int(self.src[e] + self.dst[e]) - v
+        return np.array(path[::-1], dtype=np.int64)
+
+    def shortest_path(self, source: int, target: int, weight: np.ndarray=None,
+            mask: np.ndarray=None) -> np.ndarray:
+        """
+        edge ids of a shortest path by hops (weight None) or by weight
+        """
+        if weight is None:
+            _, pred = self.bfs(source, mask)
+        else:
+            _, pred = self.dijkstra(source, weight, target, mask)
+        return self.trace(pred, source, target)
+
+    def disjoint_paths(self, source: int, target: int, path_num: int=5,
+            weight: np.ndarray=None) -> 'list[np.ndarray]':
+        """
+        greedy edge-disjoint paths as edge ids, see QuNet.disjoint_paths
+        """
+        mask = np.ones(self.n_edges, dtype=bool)
+        paths = []
+        for _ in range(path_num):
+            path = self.shortest_path(source, target, weight, mask)
+            if path is None:
+                break
+            paths.append(path)
+            mask[path] = False
+        return paths
+
+    def edge_tuples(self, source: int, path: np.ndarray) -> StaticPath:
+        """
+        a path of edge ids from position source as (u, v) node id tuples
+        """
+        u = source
+        out = []
+        for e in path.tolist():
+            a, b = int(self.src[e]), int(self.dst[e])
+            v = b if a == u else a
+            out.append((int(self.ids[u]), int(self.ids[v])))
+            u = v
+        return tuple(out)
+
+
+class ArrayNode:
+    """
+    a node of an ArrayNet, storage reads & writes the arrays
+    duck-types network.graph.BufferedNode
+    """
+
+    def __init__(self, arrays: ArrayNet, k: int) -> None:
+        self.arrays = arrays
+        self.k = k
+        self.node_id = int(arrays.ids[k])
+
+    @property
+    def storage(self) -> int:
+        return int(self.arrays.storage[self.k])
+
+    @storage.setter
+    def storage(self, value: int) -> None:
+        self.arrays.storage[self.k] = value
+
+    def __str__(self):
+        return str(self.node_id)
+
+
+class ArrayEdge:
+    """
+    an edge of an ArrayNet, fid & capacity read & write the arrays
+    duck-types network.graph.Edge
+    """
+
+    def __init__(self, arrays: ArrayNet, e: int) -> None:
+        self.arrays = arrays
+        self.e = e
+        self.src_node = int(arrays.ids[arrays.src[e]])
+        self.dst_node = int(arrays.ids[arrays.dst[e]])
+        self.edge_tuple = (self.src_node, self.dst_node)
+
+    @property
+    def fid(self) -> float:
+        return float(self.arrays.fid[self.e])
+
+    @fid.setter
+    def fid(self, value: float) -> None:
+        self.arrays.fid[self.e] = value
+
+    @property
+    def capacity(self) -> int:
+        return int(self.arrays.capacity[self.e])
+
+    @capacity.setter
+    def capacity(self, value: int) -> None:
+        self.arrays.capacity[self.e] = value
+
+    def __str__(self):
+        desc = f'Edge {self.edge_tuple}: '
+        desc += f'(fid, cap) = ({self.fid}, capacity={self.capacity}) '
+        return desc
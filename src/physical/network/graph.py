@@ -1,12 +1,13 @@
 
 from enum import Enum
-import copy
+import heapq
 
 import networkx as nx
 import numpy as np
 import matplotlib.pyplot as plt
 
 from .topology import _RealTopo, ATT, IBM
+from .arraynet import ArrayNet, ArrayNode, ArrayEdge
 import physical.quantum as qu
 
 from .types import NodeID, NodePair, StaticPath, EdgeTuple
@@ -63,32 +64,157 @@ class QuNet:
             plt.savefig(filename)
 
     @staticmethod
-    def disjoint_paths(net: nx.Graph, src: NodeID, dst: NodeID, path_num: int=5):
+    def _weight_fn(weight):
+        # weight: None for hop count, an edge attribute name, or f(u, v, data)
+        if weight is None:
+            return lambda u, v, data: 1
+        if callable(weight):
+            return weight
+        return lambda u, v, data: data.get(weight, 1)
+
+    def fid_weight(self, gate: qu.Gate=None, capacity_weight: float=0.0):
         """
-        Find at most k disjoint paths from src to dst
+        edge weight f(u, v, data) for fidelity-aware paths
+        -log of the normalized swap factor of the edge fid (Gate.swap_weight),
+        plus capacity_weight * log(max capacity / capacity)
+        edges whose swap factor is not positive get None (never used)
+        """
+        if gate is None:
+            gate = self.gate
+        max_cap = max((data['obj'].capacity for _, _, data in self.net.edges(data=True)),
+            default=1)
+
+        def weight(u, v, data):
+            edge: Edge = data['obj']
+            w = float(gate.swap_weight(edge.fid))
+            if w == float('inf'):
+                return None
+            if capacity_weight > 0:
+                w += capacity_weight * np.log(max_cap / edge.capacity)
+            return w
+
+        return weight
+
+    @staticmethod
+    def disjoint_paths(net: nx.Graph, src: NodeID, dst: NodeID, path_num: int=5,
+            method: str='greedy', weight=None):
+        """
+        Find at most k disjoint (by edge) paths from src to dst
         If no enough paths, return all paths found
+        method:
+            'greedy': repeated shortest paths, removing the edges of each one
+            'suurballe': k paths of min total weight (min-cost flow)
+        weight: see _weight_fn, edges with weight None are not used
+        the graph is never copied, used edges are masked in a view
         """
+        if method == 'suurballe':
+            return QuNet._min_cost_paths(net, src, dst, path_num, weight)
+        if method != 'greedy':
+            raise ValueError('method must be greedy or suurballe')
+
         paths: list[StaticPath] = []
-        # make a deep copy of the graph when processing each user pair 
-        # to find disjoint paths
-        tnet = copy.deepcopy(net)
-        for i in range(path_num):
+        used: 'set[EdgeTuple]' = set()
+        view = nx.subgraph_view(net, filter_edge=lambda u, v: (u, v) not in used)
+        for _ in range(path_num):
             try:
-                path_nodes: list[NodeID] = nx.shortest_path(tnet, src, dst)
+                if weight is None:
+                    path_nodes: list[NodeID] = nx.shortest_path(view, src, dst)
+                else:
+                    path_nodes = nx.dijkstra_path(view, src, dst, weight=weight)
             except nx.NetworkXNoPath:
                 break
 
             path = []
-            # remove the edges in the path
+            # mask the edges in the path
             for i in range(len(path_nodes)-1):
                 edge_tuple = (path_nodes[i], path_nodes[i+1])
                 path.append(edge_tuple)
-                tnet.remove_edge(edge_tuple[0], edge_tuple[1])
+                used.add(edge_tuple)
+                used.add(edge_tuple[::-1])
 
             paths.append(tuple(path))
 
         return paths
 
+    @staticmethod
+    def _min_cost_paths(net: nx.Graph, src: NodeID, dst: NodeID, path_num: int, weight=None):
+        """
+        edge-disjoint paths of min total weight: successive shortest paths
+        on the residual graph, Dijkstra with potentials (Suurballe)
+        every undirected edge is two unit arcs, flow on both cancels
+        """
+        weight_fn = QuNet._weight_fn(weight)
+        # flow[(u, v)] = 1 if arc u -> v carries flow
+        flow: 'dict[EdgeTuple, int]' = {}
+        pi: 'dict[NodeID, float]' = {}
+
+        def arc_cost(u, v):
+            data = net.edges[u, v]
+            return weight_fn(u, v, data)
+
+        found = 0
+        for _ in range(path_num):
+            # Dijkstra on reduced costs c(u, v) + pi[u] - pi[v] >= 0
+            dist = {src: 0.0}
+            prev = {}
+            heap = [(0.0, 0, src)]
+            count = 1
+            done = set()
+            while len(heap) > 0:
+                d, _, u = heapq.heappop(heap)
+                if u in done:
+                    continue
+                done.add(u)
+                for v in net.neighbors(u):
+                    if flow.get((u, v), 0) == 1:
+                        continue
+                    if flow.get((v, u), 0) == 1:
+                        # cancel the flow on v -> u
+                        c = -arc_cost(v, u)
+                    else:
+                        c = arc_cost(u, v)
+                        if c is None:
+                            continue
+                    nd = d + c + pi.get(u, 0.0) - pi.get(v, 0.0)
+                    if v not in done and nd < dist.get(v, float('inf')) - 1e-12:
+                        dist[v] = nd
+                        prev[v] = u
+                        heapq.heappush(heap, (nd, count, v))
+                        count += 1
+            if dst not in done:
+                break
+
+            for node in done:
+                pi[node] = pi.get(node, 0.0) + dist[node]
+            v = dst
+            while v != src:
+                u = prev[v]
+                if flow.get((v, u), 0) == 1:
+                    flow[(v, u)] = 0
+                else:
+                    flow[(u, v)] = 1
+                v = u
+            found += 1
+
+        # decompose the flow into paths
+        out_arcs: 'dict[NodeID, list[NodeID]]' = {}
+        for (u, v), f in flow.items():
+            if f == 1:
+                out_arcs.setdefault(u, []).append(v)
+        paths: list[StaticPath] = []
+        for _ in range(found):
+            nodes = [src]
+            while nodes[-1] != dst:
+                v = out_arcs[nodes[-1]].pop()
+                if v in nodes:
+                    # drop a zero cost loop
+                    nodes = nodes[:nodes.index(v)]
+                nodes.append(v)
+            paths.append(tuple((nodes[i], nodes[i+1]) for i in range(len(nodes) - 1)))
+
+        total = lambda path: sum(arc_cost(u, v) for u, v in path)
+        return sorted(paths, key=total)
+
     def __init__(self, topology: _RealTopo=ATT(), gate: qu.Gate=qu.GDP):
         self.topology = topology
         self.gate = gate
@@ -96,12 +222,44 @@ class QuNet:
         # real network, without virtual edges among QMs
         self.net = nx.Graph()
         self.nodes = list(topology.nodes)
-        self.adjacency = topology.adjacency
+        # array storage of the network, set in net_gen()
+        self.arrays: ArrayNet = None
+        # PathIndex by (path_num, method, weight), see path_index()
+        self._path_indices: dict = {}
+
+    @property
+    def adjacency(self) -> np.ndarray:
+        # dense, small topologies only, see topology.sparse_adjacency
+        return self.topology.adjacency
+
+    def path_index(self, path_num: int=3, method: str='greedy', weight=None,
+            workers: int=None, cache_dir: str=None, lazy: bool=False):
+        """
+        the PathIndex of all node pairs, made on first use
+        lazy: find the paths of each pair on its first lookup
+        see pathindex.PathIndex
+        """
+        from .pathindex import PathIndex
+        key = (path_num, method, weight)
+        if key not in self._path_indices:
+            self._path_indices[key] = PathIndex(self, path_num, method, weight,
+                workers, cache_dir, lazy)
+        else:
+            index = self._path_indices[key]
+            # later callers may add a cache dir or a pool
+            if workers is not None:
+                index.workers = workers
+            if cache_dir is not None:
+                index.cache_dir = cache_dir
+            if not lazy and index.stale.all():
+                index.build(workers)
+        return self._path_indices[key]
 
     def net_gen(self,
                 node_memory=(50, 100),
                 edge_capacity=(26, 35),
                 edge_fidelity=(0.7, 0.95),
+                graph: bool=True,
         ):
         """
         Generate the real network according to
@@ -109,19 +267,21 @@ class QuNet:
         storage: storage capacity of each nodes
         capacity: capacity of each edge, must have same shape as adjacency
         fidelity: fidelity of each edge, must have same shape as adjacency
+        all values are drawn at once into self.arrays (an ArrayNet)
+        graph: also fill self.net with nodes & edges viewing the arrays
         """
+        self._path_indices.clear()
 
-        for i, node_id in enumerate(self.nodes):
-            memory = np.random.randint(node_memory[0], node_memory[1])
-            obj=BufferedNode(node_id, memory)
-            self.net.add_node(node_id, obj=obj)
-        
-        for i, edge in enumerate(self.topology.edges):
-            cap = np.random.randint(edge_capacity[0], edge_capacity[1])
-            fid = np.random.uniform(edge_fidelity[0], edge_fidelity[1])
-            edge_tuple = (edge[0], edge[1])
-            obj = Edge(*edge_tuple, fid, cap)
-            self.net.add_edge(edge[0], edge[1], obj=obj)
+        edges = self.topology.edge_array
+        self.arrays = ArrayNet.from_edges(edges, self.nodes)
+        self.arrays.generate(node_memory, edge_capacity, edge_fidelity)
+
+        if graph:
+            arrays = self.arrays
+            self.net.add_nodes_from((node_id, {'obj': ArrayNode(arrays, arrays.pos(node_id))})
+                for node_id in self.nodes)
+            self.net.add_edges_from((u, v, {'obj': ArrayEdge(arrays, e)})
+                for e, (u, v) in enumerate(edges.tolist()))
 
 
 class QuNetTask:
@@ -152,12 +312,28 @@ class QuNetTask:
             up_indices = np.random.choice(len(user_pairs), pair_num, replace=False)
             self.user_pairs = [user_pairs[idx] for idx in up_indices]
 
-    def set_up_paths(self, path_num=3):
+    def set_up_paths(self, path_num=3, method='greedy', weight=None, indexed=True,
+            workers=None, cache_dir=None):
         """
         find disjoint (by edge) real & virtual paths for each user pair
+        method & weight: see QuNet.disjoint_paths,
+            weight='fid' for QuNet.fid_weight()
+        indexed: look the paths up in QuNet.path_index(), kept by the net
+            for all tasks and filled pair by pair, otherwise search them
+            for these pairs only
+        workers & cache_dir: see pathindex.PathIndex, the pairs missing
+            from the index are searched on workers processes and saved
         """
+        if indexed:
+            index = self.qunet.path_index(path_num, method, weight, workers, cache_dir, lazy=True)
+            index.prefetch(self.user_pairs)
+        elif isinstance(weight, str) and weight == 'fid':
+            weight = self.qunet.fid_weight()
         for user_pair in self.user_pairs:
-            paths = QuNet.disjoint_paths(self.qunet.net, *user_pair, path_num)
+            if indexed:
+                paths = index.paths(*user_pair)
+            else:
+                paths = QuNet.disjoint_paths(self.qunet.net, *user_pair, path_num, method, weight)
             self.up_paths[user_pair] = []
             for path in paths:
                 self.up_paths[user_pair].append(path)
@@ -0,0 +1,337 @@
+
+
+# all-pairs index of disjoint paths of a QuNet
+# pairs are ordered (src, dst): greedy paths depend on the search direction
+# paths are built at once (on a process pool) or pair by pair on lookup
+# (lazy), and stored as CSR arrays:
+#   pair_ptr    (pairs + 1), paths of pair k are pair_ptr[k]:pair_ptr[k+1]
+#   path_ptr    (paths + 1), edges of path t are path_ptr[t]:path_ptr[t+1]
+#   path_edges  edge ids, in path order from src
+# a reverse CSR (edge_ptr, edge_paths) maps every edge to the paths using it,
+# so changing an edge only recomputes the pairs with a path through it
+# the light graph searched for paths has the same adjacency order as the
+# net, so its paths are exactly those of QuNet.disjoint_paths on the net
+# an index can be saved to a cache file named by the hash of the topology,
+# a lazy index saves the pairs found so far and loads them back
+
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+
+import networkx as nx
+import numpy as np
+
+from .types import NodeID, NodePair, StaticPath, EdgeTuple
+
+
+# per-worker state, set by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(graph: nx.Graph, path_num: int, method: str, weighted: bool) -> None:
+    _worker.update(graph=graph, path_num=path_num, method=method, weighted=weighted)
+
+
+def _pair_paths(graph: nx.Graph, src: NodeID, dst: NodeID, path_num: int,
+        method: str, weighted: bool) -> 'list[list[int]]':
+    # edge ids of the disjoint paths from src to dst
+    from .graph import QuNet
+    paths = QuNet.disjoint_paths(graph, src, dst, path_num, method, 'w' if weighted else None)
+    return [[graph.edges[edge]['eid'] for edge in path] for path in paths]
+
+
+def _solve_chunk(pairs: 'list[NodePair]') -> 'list[list[list[int]]]':
+    return [_pair_paths(_worker['graph'], src, dst, _worker['path_num'],
+        _worker['method'], _worker['weighted']) for src, dst in pairs]
+
+
+def _insertion_order(net: nx.Graph) -> 'list[EdgeTuple]':
+    """
+    the edges in an order that rebuilds the neighbor order of every node:
+    an edge goes once it is next in the neighbor order of both its ends
+    """
+    chains = {u: list(nbrs) for u, nbrs in net.adj.items()}
+    at = dict.fromkeys(chains, 0)
+
+    def head(u: NodeID) -> NodeID:
+        return chains[u][at[u]] if at[u] < len(chains[u]) else None
+
+    order = []
+    stack = [(u, head(u)) for u in reversed(list(chains)) if head(u) is not None]
+    while len(stack) > 0:
+        u, v = stack.pop()
+        if head(u) != v or head(v) != u:
+            continue
+        order.append((u, v))
+        at[u] += 1
+        if v != u:
+            at[v] += 1
+        for w in (v, u):
+            x = head(w)
+            if x is not None and head(x) == w:
+                stack.append((w, x))
+    assert len(order) == net.number_of_edges(), 'inconsistent neighbor orders'
+    return order
+
+
+class PathIndex:
+    """
+    k disjoint paths from every node to every other node of a QuNet
+    path_num, method & weight: see QuNet.disjoint_paths,
+        weight='fid' for QuNet.fid_weight()
+    workers: processes used to build the index or prefetch pairs,
+        1 to search in place
+    cache_dir: where the index is saved & loaded, None to keep it in memory
+    lazy: find the paths of a pair on its first lookup or prefetch
+        instead of all at once
+    """
+
+    def __init__(self, qunet, path_num: int=3, method: str='greedy', weight=None,
+            workers: int=None, cache_dir: str=None, lazy: bool=False) -> None:
+        self.qunet = qunet
+        self.path_num = path_num
+        self.method = method
+        if isinstance(weight, str) and weight == 'fid':
+            weight = qunet.fid_weight()
+        self.weight = weight
+        self.workers = workers
+        self.cache_dir = cache_dir
+        if qunet.net.number_of_edges() == 0 and qunet.arrays is not None:
+            raise ValueError('the path index searches the graph, '
+                'call net_gen(graph=True)')
+
+        self.nodes: 'list[NodeID]' = sorted(qunet.net.nodes)
+        self.node_pos = {node: i for i, node in enumerate(self.nodes)}
+        # edge id -> endpoints, (u, v) & (v, u) -> edge id
+        self.edges = np.array(sorted(tuple(sorted(edge)) for edge in qunet.net.edges),
+            dtype=np.int64).reshape(-1, 2)
+        self.edge_id: 'dict[EdgeTuple, int]' = {}
+        for e, (u, v) in enumerate(self.edges.tolist()):
+            self.edge_id[(u, v)] = self.edge_id[(v, u)] = e
+
+        # weighted light copy of the net, only ids & weights, cheap to pickle
+        # (same node & neighbor order as the net, so ties break the same way)
+        self.graph = nx.Graph()
+        self.graph.add_nodes_from(qunet.net.nodes)
+        for u, v in _insertion_order(qunet.net):
+            self._refresh_edge(self.edge_id[(u, v)])
+
+        self.pair_ptr: np.ndarray = None
+        self.path_ptr: np.ndarray = None
+        self.path_edges: np.ndarray = None
+        self.edge_ptr: np.ndarray = None
+        self.edge_paths: np.ndarray = None
+        # paths of a pair in the CSR arrays are stale
+        self.stale: np.ndarray = None
+        # recomputed paths of stale pairs, pair index -> edge ids of each path
+        self._patched: 'dict[int, list[list[int]]]' = {}
+
+        path = self.cache_file()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+        elif lazy:
+            # every pair stale, found on lookup
+            self._pack([[] for _ in range(self.n_pairs)])
+            self.stale[:] = True
+        else:
+            self.build(workers)
+            if path is not None:
+                self.save(path)
+
+    @property
+    def n_pairs(self) -> int:
+        n = len(self.nodes)
+        return n * (n - 1)
+
+    def pair_index(self, src: NodeID, dst: NodeID) -> int:
+        """
+        index of the ordered pair, row-major by node position without the diagonal
+        """
+        i, j = self.node_pos[src], self.node_pos[dst]
+        assert i != j, 'src and dst must be different'
+        return i * (len(self.nodes) - 1) + j - (j > i)
+
+    def _pairs(self) -> 'list[NodePair]':
+        return [(src, dst) for src in self.nodes for dst in self.nodes if src != dst]
+
+    def _edge_weight(self, u: NodeID, v: NodeID) -> float:
+        if self.weight is None:
+            return 1
+        data = self.qunet.net.edges[u, v]
+        if callable(self.weight):
+            return self.weight(u, v, data)
+        return data.get(self.weight, 1)
+
+    def _refresh_edge(self, e: int) -> None:
+        # copy edge e from the net into the light graph, drop it if removed
+        # an unusable edge stays with weight None, hidden as in the net,
+        # so the neighbor order is kept
+        u, v = self.edges[e].tolist()
+        if self.qunet.net.has_edge(u, v):
+            self.graph.add_edge(u, v, eid=e, w=self._edge_weight(u, v))
+        elif self.graph.has_edge(u, v):
+            self.graph.remove_edge(u, v)
+
+    def digest(self) -> str:
+        """
+        hash of the topology, the path settings and the edge weights
+        the neighbor order of every node is hashed too: searches break
+        ties by it, so equal edge sets may give different paths
+        """
+        h = hashlib.sha256()
+        h.update(repr((self.nodes, self.path_num, self.method, 'ordered')).encode())
+        h.update(self.edges.tobytes())
+        adj = [(u, list(nbrs)) for u, nbrs in self.graph.adj.items()]
+        h.update(repr(adj).encode())
+        if self.weight is not None:
+            w = [self.graph.edges[u, v]['w'] if self.graph.has_edge(u, v) else None
+                for u, v in self.edges.tolist()]
+            w = [np.nan if x is None else x for x in w]
+            h.update(np.round(np.array(w, dtype=float), 12).tobytes())
+        return h.hexdigest()
+
+    def cache_file(self) -> str:
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f'pathindex-{self.digest()[:32]}.npz')
+
+    def build(self, workers: int=None) -> None:
+        """
+        find the paths of all pairs, on a process pool if workers > 1
+        """
+        self._pack(self._search(self._pairs(), workers))
+
+    def _search(self, pairs: 'list[NodePair]', workers: int=None) -> 'list[list[list[int]]]':
+        # edge ids of the paths of each pair, on a process pool if workers > 1
+        if workers is None:
+            workers = os.cpu_count()
+        weighted = self.weight is not None
+
+        if workers <= 1 or len(pairs) < 2 * workers:
+            return [_pair_paths(self.graph, src, dst, self.path_num, self.method, weighted)
+                for src, dst in pairs]
+        chunksize = max(1, len(pairs) // (4 * workers))
+        chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+        with ProcessPoolExecutor(min(workers, len(chunks)), initializer=_init_worker,
+                initargs=(self.graph, self.path_num, self.method, weighted)) as pool:
+            return [paths for chunk in pool.map(_solve_chunk, chunks) for paths in chunk]
+
+    def prefetch(self, pairs: 'list[NodePair]') -> None:
+        """
+        find the paths of the stale pairs among pairs at once,
+        on a process pool if workers > 1, and save them to cache_dir
+        """
+        missing = [(src, dst) for src, dst in pairs
+            if self.stale[self.pair_index(src, dst)]
+            and self.pair_index(src, dst) not in self._patched]
+        if len(missing) == 0:
+            return
+        found = self._search(missing, self.workers)
+        for (src, dst), paths in zip(missing, found):
+            self._patched[self.pair_index(src, dst)] = paths
+        path = self.cache_file()
+        if path is not None:
+            self.save(path)
+
+    def _pack(self, found: 'list[list[list[int]]]') -> None:
+        # CSR arrays from the edge ids of the paths of every pair
+        pair_ptr = np.zeros(len(found) + 1, dtype=np.int64)
+        pair_ptr[1:] = np.cumsum([len(paths) for paths in found])
+        all_paths = [path for paths in found for path in paths]
+        path_ptr = np.zeros(len(all_paths) + 1, dtype=np.int64)
+        path_ptr[1:] = np.cumsum([len(path) for path in all_paths])
+        path_edges = np.fromiter((e for path in all_paths for e in path),
+            dtype=np.int32, count=int(path_ptr[-1]))
+        self._set_arrays(pair_ptr, path_ptr, path_edges)
+
+    def _set_arrays(self, pair_ptr: np.ndarray, path_ptr: np.ndarray,
+            path_edges: np.ndarray) -> None:
+        self.pair_ptr, self.path_ptr, self.path_edges = pair_ptr, path_ptr, path_edges
+        # reverse index: edge -> paths through it
+        owner = np.repeat(np.arange(len(path_ptr) - 1, dtype=np.int32), np.diff(path_ptr))
+        order = np.argsort(path_edges, kind='stable')
+        self.edge_paths = owner[order]
+        self.edge_ptr = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.edge_ptr[1:] = np.cumsum(np.bincount(path_edges, minlength=len(self.edges)))
+        self.stale = np.zeros(len(pair_ptr) - 1, dtype=bool)
+        self._patched.clear()
+
+    def _compact(self) -> None:
+        # fold the recomputed paths of stale pairs back into the arrays,
+        # pairs never looked up stay stale with no paths
+        pairs = self._pairs()
+        known = ~self.stale
+        known[list(self._patched)] = True
+        self._pack([[ids.tolist() for ids in self.path_ids(src, dst)] if ok else []
+            for (src, dst), ok in zip(pairs, known.tolist())])
+        self.stale = ~known
+
+    def save(self, path: str) -> None:
+        if self.stale.any():
+            self._compact()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + f'.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, digest=np.array(self.digest()), edges=self.edges,
+                pair_ptr=self.pair_ptr, path_ptr=self.path_ptr, path_edges=self.path_edges,
+                stale=self.stale)
+        # readers never see a partial file
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            if str(data['digest']) != self.digest() or \
+                    not np.array_equal(data['edges'], self.edges):
+                raise ValueError('path index does not match the network')
+            self._set_arrays(data['pair_ptr'], data['path_ptr'], data['path_edges'])
+            if 'stale' in data.files:
+                self.stale = data['stale'].copy()
+
+    def path_ids(self, src: NodeID, dst: NodeID) -> 'list[np.ndarray]':
+        """
+        edge ids of each path from src to dst, in path order
+        """
+        k = self.pair_index(src, dst)
+        if self.stale[k]:
+            if k not in self._patched:
+                self._patched[k] = _pair_paths(self.graph, src, dst,
+                    self.path_num, self.method, self.weight is not None)
+            return [np.array(path, dtype=np.int32) for path in self._patched[k]]
+        lo, hi = self.pair_ptr[k], self.pair_ptr[k + 1]
+        return [self.path_edges[self.path_ptr[t]:self.path_ptr[t + 1]] for t in range(lo, hi)]
+
+    def paths(self, src: NodeID, dst: NodeID) -> 'list[StaticPath]':
+        """
+        the disjoint paths from src to dst as edge tuples
+        """
+        out = []
+        for ids in self.path_ids(src, dst):
+            node = src
+            path = []
+            for u, v in self.edges[ids].tolist():
+                nxt = v if node == u else u
+                path.append((node, nxt))
+                node = nxt
+            out.append(tuple(path))
+        return out
+
+    def invalidate(self, u: NodeID, v: NodeID) -> 'list[int]':
+        """
+        edge (u, v) of the net changed (fid, capacity, removed):
+        refresh its weight and recompute the pairs with a path through it
+        on their next lookup, return the indices of those pairs
+        other pairs keep their paths even if the edge would now suit them
+        """
+        e = self.edge_id[(u, v)]
+        self._refresh_edge(e)
+        path_ids = self.edge_paths[self.edge_ptr[e]:self.edge_ptr[e + 1]]
+        pairs = np.searchsorted(self.pair_ptr, path_ids, side='right') - 1
+        # patched pairs may route through the edge too
+        pairs = set(pairs.tolist())
+        pairs.update(k for k, paths in self._patched.items()
+            if any(e in path for path in paths))
+        for k in pairs:
+            self.stale[k] = True
+            self._patched.pop(k, None)
+        return sorted(pairs)
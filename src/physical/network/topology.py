@@ -1,4 +1,3 @@
-
 import os
 from abc import ABC, abstractmethod
 
@@ -6,116 +5,310 @@ import numpy as np
 import networkx as nx
 
 
+# largest topology with a dense adjacency matrix (n x n float64)
+MAX_DENSE_NODES = 10000
+
+
+class SparseAdjacency:
+    """
+    symmetric adjacency matrix of n nodes
+    COO: rows, cols, values, both directions of every edge
+    CSR: indptr, indices, data, built from the COO arrays
+    """
+
+    def __init__(self, n: int, src: np.ndarray, dst: np.ndarray, weights: np.ndarray) -> None:
+        self.shape = (n, n)
+        self.rows = np.concatenate([src, dst]).astype(np.int64)
+        self.cols = np.concatenate([dst, src]).astype(np.int64)
+        self.values = np.concatenate([weights, weights]).astype(np.float64)
+
+        order = np.lexsort((self.cols, self.rows))
+        self.indices = self.cols[order]
+        self.data = self.values[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(self.rows, minlength=n))
+
+    @property
+    def nnz(self) -> int:
+        return len(self.values)
+
+    def degree(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def __getitem__(self, index: 'tuple[int, int]') -> float:
+        i, j = index
+        lo, hi = self.indptr[i], self.indptr[i + 1]
+        k = lo + np.searchsorted(self.indices[lo:hi], j)
+        if k < hi and self.indices[k] == j:
+            return float(self.data[k])
+        return 0.0
+
+    def toarray(self, max_nodes: int=MAX_DENSE_NODES) -> np.ndarray:
+        """
+        dense n x n matrix, only for graphs of at most max_nodes
+        """
+        n = self.shape[0]
+        if n > max_nodes:
+            raise ValueError(f'{n} nodes is too large for a dense adjacency '
+                f'(max_nodes={max_nodes}), use the sparse one')
+        dense = np.zeros(self.shape)
+        dense[self.rows, self.cols] = self.values
+        return dense
+
+
 class Topology(ABC):
     def __init__(self) -> None:
         self.nodes: 'set[int]' = set()
-        self.edges: 'set[tuple[int]]' = set()
-        # adjacency matrix
-        self.adjacency: np.ndarray
+        # endpoints (m, 2) & weight of every undirected edge
+        self.edge_array = np.zeros((0, 2), dtype=np.int64)
+        self.edge_weights = np.zeros(0)
+        self.n_nodes = 0
+
+        self._edges: 'set[tuple[int]]' = None
+        self._sparse: SparseAdjacency = None
+        self._dense: np.ndarray = None
 
     @abstractmethod
     def topo_analyze(self, ) -> None:
         pass
 
+    def _set_edges(self, n_nodes: int, edge_array: np.ndarray, weights: np.ndarray) -> None:
+        # new edges, drop the views built from the old ones
+        self.n_nodes = n_nodes
+        self.edge_array = np.asarray(edge_array, dtype=np.int64).reshape(-1, 2)
+        self.edge_weights = np.asarray(weights, dtype=np.float64)
+        self._edges, self._sparse, self._dense = None, None, None
+
+    def _edge_tuples(self) -> 'set[tuple[int]]':
+        return set(map(tuple, self.edge_array.tolist()))
+
+    @property
+    def edges(self) -> 'set[tuple[int]]':
+        # edge tuples, built on first access
+        if self._edges is None:
+            self._edges = self._edge_tuples()
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges: 'set[tuple[int]]') -> None:
+        self._edges = edges
+
+    @property
+    def sparse_adjacency(self) -> SparseAdjacency:
+        if self._sparse is None:
+            self._sparse = SparseAdjacency(self.n_nodes, self.edge_array[:, 0],
+                self.edge_array[:, 1], self.edge_weights)
+        return self._sparse
+
+    @property
+    def adjacency(self) -> np.ndarray:
+        # dense adjacency matrix, built on first access, small graphs only
+        if self._dense is None:
+            self._dense = self.sparse_adjacency.toarray()
+        return self._dense
+
 
 class _RealTopo(Topology):
-    def __init__(self, filename):
+    """
+    baseline: parse the edges as the original experiments did, which drops
+    a few edges (3 of ATT) and orders them by set iteration, for exact
+    reproduction of old results; otherwise every edge of the file is kept
+    once, in file order
+    """
+
+    def __init__(self, filename, baseline: bool=False):
+        super().__init__()
         self.filename = filename
+        self.baseline = baseline
 
-        f = open(filename)
-        self._lines = f.readlines()[1:]
-        self._lines = [line.strip() for line in self._lines]
-        self._lines = [line.split() for line in self._lines]
-        self._lines = [[int(line[0]), int(line[1]), float(line[2])] for line in self._lines]
-
-        self.nodes: 'set[int]' = set()
-        self.edges: 'set[tuple[int]]' = set()
-        # adjacency matrix
-        self.adjacency: np.ndarray
+        # (to_node, from_node, capacity) of every line
+        self._lines = np.loadtxt(filename, skiprows=1, usecols=(0, 1, 2), ndmin=2)
 
-        # get the three attributes above
+        # get the nodes, edges and adjacency
         self.topo_analyze()
-    
+
     def topo_analyze(self):
         """
         Analyze topology:
         get vertices, edges and adjacency matrix.
         """
-
-        # get vertices and edges
-        for line in self._lines:
-            self.nodes.add(line[0] - 1)
-            self.nodes.add(line[1] - 1)
-
-            if (line[1], line[0], line[2]) not in self.edges:
-                self.edges.add((line[0] - 1, line[1] - 1, line[2]))
-
-        # get adjacency matrix
-        self.adjacency = np.zeros((len(self.nodes), len(self.nodes)))
-        for edge in self.edges:
-            # edge[0] and edge[1] are vertices
-            # edge[2] is the capacity of the edge
-            self.adjacency[edge[0], edge[1]] = edge[2]
-            self.adjacency[edge[1], edge[0]] = edge[2]
+        ends = self._lines[:, :2].astype(np.int64) - 1
+        self.nodes = set(np.unique(ends).tolist())
+        n_nodes = int(ends.max()) + 1 if len(ends) > 0 else 0
+        if self.baseline:
+            self._baseline_edges(n_nodes, ends)
+            return
+
+        # first line of every undirected edge, in file order
+        _, first = np.unique(np.sort(ends, axis=1), axis=0, return_index=True)
+        first = np.sort(first)
+        self._set_edges(n_nodes, ends[first], self._lines[first, 2])
+
+    def _baseline_edges(self, n_nodes: int, ends: np.ndarray) -> None:
+        # the edge set as originally parsed: (u, v, capacity), most edges in
+        # both directions; the check compares the 1-based line with the
+        # 0-based tuples, so a few edges are dropped
+        edges: 'set[tuple[int]]' = set()
+        for (u, v), (a, b, c) in zip(ends.tolist(), self._lines.tolist()):
+            if (int(b), int(a), c) not in edges:
+                edges.add((u, v, c))
+
+        # undirected edges in the iteration order of the set (fixed, int &
+        # float hashes are not salted), the order QuNet.net_gen adds them
+        # in, so the neighbor order of the graph is the original one
+        seen: 'set[tuple[int]]' = set()
+        kept = []
+        for u, v, c in edges:
+            if (u, v) not in seen:
+                seen.update(((u, v), (v, u)))
+                kept.append((u, v, c))
+        kept = np.array(kept, dtype=np.float64).reshape(-1, 3)
+
+        self._set_edges(n_nodes, kept[:, :2], kept[:, 2])
+        self.edges = edges
+
+    def _edge_tuples(self) -> 'set[tuple[int]]':
+        # (u, v, capacity)
+        return {(u, v, c) for (u, v), c in zip(self.edge_array.tolist(), self.edge_weights.tolist())}
 
 
 class ATT(_RealTopo):
-    def __init__(self, ):
+    def __init__(self, baseline: bool=False):
         att_file = 'raw_topo/ATT.txt'
         filename = os.path.join(os.path.dirname(__file__), att_file)
-        super().__init__(filename)
+        super().__init__(filename, baseline)
 
 
 class IBM(_RealTopo):
-    def __init__(self, ):
+    def __init__(self, baseline: bool=False):
         ibm_file = 'raw_topo/IBM.txt'
         filename = os.path.join(os.path.dirname(__file__), ibm_file)
-        super().__init__(filename)
+        super().__init__(filename, baseline)
 
 
 class RandomTopo(Topology):
-    def __init__(self,):
+    def __init__(self, n: int):
         super().__init__()
 
-        self.net: nx.Graph = None
+        self.n = n
+        self._net: nx.Graph = None
 
     @abstractmethod
-    def net_gen(self) -> nx.Graph:
+    def net_gen(self) -> np.ndarray:
+        """
+        draw the edges, return them as an (m, 2) array
+        """
         pass
 
-    def topo_analyze(self,):
-        self.nodes = set(self.net.nodes)
-        self.edges = set(self.net.edges)
+    @property
+    def net(self) -> nx.Graph:
+        # networkx view of the edges, built on first access
+        if self._net is None:
+            net = nx.Graph()
+            net.add_nodes_from(range(self.n))
+            net.add_edges_from(self.edge_array.tolist())
+            self._net = net
+        return self._net
+
+    @net.setter
+    def net(self, net: nx.Graph) -> None:
+        # a graph drawn elsewhere on nodes 0..n-1, replaces the edges
+        self.n = net.number_of_nodes()
+        self.edge_array = np.array(list(net.edges), dtype=np.int64).reshape(-1, 2)
+        self.topo_analyze()
+        self._net = net
 
-        self.adjacency = np.zeros((len(self.nodes), len(self.nodes)))
-        for edge in self.edges:
-            self.adjacency[edge[0], edge[1]] = 1
-            self.adjacency[edge[1], edge[0]] = 1
+    def topo_analyze(self,):
+        self.nodes = set(range(self.n))
+        self._set_edges(self.n, self.edge_array, np.ones(len(self.edge_array)))
+        self._net = None
 
 
 class RandomPAG(RandomTopo):
     def __init__(self, n, m):
-        super().__init__()
+        super().__init__(n)
 
-        self.n = n
         self.m = m
 
         self.net_gen()
         self.topo_analyze()
-        
+
     def net_gen(self):
-        self.net: nx.Graph = nx.barabasi_albert_graph(self.n, self.m)
+        """
+        Barabasi-Albert preferential attachment, as nx.barabasi_albert_graph:
+        a star of m + 1 nodes, then every new node links to m distinct nodes
+        drawn by degree from the endpoints of all edges so far
+        """
+        n, m = self.n, self.m
+        if m < 1 or m >= n:
+            raise ValueError(f'BA network must have m >= 1 and m < n, m = {m}, n = {n}')
+
+        sources = np.arange(m + 1, n)
+        edges = np.empty((m + len(sources) * m, 2), dtype=np.int64)
+        edges[:m, 0] = 0
+        edges[:m, 1] = np.arange(1, m + 1)
+        # endpoints of every edge, node s is drawn from the first 2m(s-m) entries
+        ends = np.empty(2 * len(edges), dtype=np.int64)
+        ends[:2*m:2], ends[1:2*m:2] = edges[:m, 0], edges[:m, 1]
+        picks = (np.random.random((len(sources), m)) * (2*m * (sources - m))[:, None]).astype(np.int64)
+
+        for k, s in enumerate(sources.tolist()):
+            targets = ends[picks[k]]
+            if len(np.unique(targets)) < m:
+                # redraw the repeated targets
+                chosen = set(targets.tolist())
+                while len(chosen) < m:
+                    chosen.add(int(ends[np.random.randint(2*m * (s - m))]))
+                targets = np.fromiter(chosen, dtype=np.int64, count=m)
+            lo = m + k*m
+            edges[lo:lo + m, 0] = s
+            edges[lo:lo + m, 1] = targets
+            ends[2*lo:2*(lo + m):2] = s
+            ends[2*lo + 1:2*(lo + m):2] = targets
+
+        self.edge_array = edges
+        return edges
 
 
 class RandomGNP(RandomTopo):
     def __init__(self, n, p):
-        super().__init__()
+        super().__init__(n)
 
-        self.n = n
         self.p = p
 
         self.net_gen()
         self.topo_analyze()
 
     def net_gen(self):
-        self.net: nx.Graph = nx.fast_gnp_random_graph(self.n, self.p)
+        """
+        G(n, p): the gaps between the chosen pairs (i < j, row-major)
+        are geometric, drawn in batches and summed
+        """
+        n, p = self.n, self.p
+        total = n * (n - 1) // 2
+        if p <= 0 or total == 0:
+            self.edge_array = np.zeros((0, 2), dtype=np.int64)
+            return self.edge_array
+
+        chunks = []
+        last = -1
+        while last < total:
+            size = int(max(16, (total - last) * p * 1.05 + 3 * np.sqrt(total * p)))
+            picks = last + np.cumsum(np.random.geometric(min(p, 1.0), size=size))
+            last = int(picks[-1])
+            chunks.append(picks[picks < total])
+        k = np.concatenate(chunks)
+
+        # row i of the upper triangle starts at i * (2n - i - 1) / 2
+        i = (n - 2 - np.floor(np.sqrt(4.0*n*(n - 1) - 8.0*k - 7) / 2 - 0.5)).astype(np.int64)
+        start = i * (2*n - i - 1) // 2
+        # fix float rounding at row boundaries
+        i -= start > k
+        start = i * (2*n - i - 1) // 2
+        over = k >= start + (n - 1 - i)
+        i += over
+        start = i * (2*n - i - 1) // 2
+        j = k - start + i + 1
+
+        self.edge_array = np.stack([i, j], axis=1)
+        return self.edge_array
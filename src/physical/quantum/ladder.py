@@ -0,0 +1,120 @@
+
+
+# recurrent purification ladder:
+# round k purifies two copies of the pair produced by round k-1
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LadderTable:
+    """
+    Interpolated ladder values of one round over a fidelity grid
+    """
+
+    def __init__(self, rounds: int, grid: np.ndarray,
+            fids: np.ndarray, probs: np.ndarray, costs: np.ndarray,
+            max_err: float) -> None:
+        self.rounds = rounds
+        self.grid = grid
+        self.fids = fids
+        self.probs = probs
+        self.costs = costs
+        # max interpolation error measured at the midpoints of the grid
+        self.max_err = max_err
+
+    def lookup(self, f) -> 'tuple[np.ndarray, np.ndarray, np.ndarray]':
+        """
+        interpolated (fidelity, probability, cost) after self.rounds rounds
+        f: scalar or ndarray inside the grid range
+        """
+        fid = np.interp(f, self.grid, self.fids)
+        prob = np.interp(f, self.grid, self.probs)
+        cost = np.interp(f, self.grid, self.costs)
+        return fid, prob, cost
+
+
+class PurifyLadder:
+    """
+    Per-Gate recurrent purification: exact values by get(),
+    interpolation tables by table(), least recently used table first out
+    fids in a live tree rarely repeat exactly, so get() is not cached
+    """
+
+    def __init__(self, gate, table_maxsize: int=16) -> None:
+        self.gate = gate
+        self.table_maxsize = table_maxsize
+
+        self._tables: 'OrderedDict[tuple, LadderTable]' = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, f: float, rounds: int=1) -> 'tuple[float, float, float]':
+        """
+        (fidelity, probability, cost) after the given rounds of purification
+        probability: success probability of the last round
+        cost: expected number of input pairs consumed, with unit input cost
+        """
+        assert rounds >= 1
+        fid, cost = float(f), 1.0
+        for _ in range(rounds):
+            fid, prob = self.gate.purify(fid, fid)
+            cost = 2*cost / prob
+        return fid, prob, cost
+
+    def ladder_batch(self, f, rounds: int=1) \
+            -> 'tuple[np.ndarray, np.ndarray, np.ndarray]':
+        """
+        vectorized get() over an array of fidelities, not cached
+        """
+        fid = np.asarray(f, dtype=float)
+        cost = np.ones(fid.shape)
+        prob = np.ones(fid.shape)
+        for _ in range(rounds):
+            fid, prob = self.gate.purify_batch(fid, fid)
+            cost = 2*cost / prob
+        return fid, prob, cost
+
+    def table(self, rounds: int=1, lo: float=0.5, hi: float=1.0,
+            tol: float=1e-6, max_points: int=2**20) -> LadderTable:
+        """
+        interpolation table of the given round over [lo, hi]
+        the grid is doubled until the midpoint error of
+        fidelity, probability and relative cost is within tol
+        """
+        key = (rounds, lo, hi, tol)
+        table = self._tables.get(key)
+        if table is not None:
+            self.hits += 1
+            self._tables.move_to_end(key)
+            return table
+        self.misses += 1
+
+        n = 65
+        while True:
+            grid = np.linspace(lo, hi, n)
+            fids, probs, costs = self.ladder_batch(grid, rounds)
+            mids = (grid[:-1] + grid[1:]) / 2
+            mf, mp, mc = self.ladder_batch(mids, rounds)
+            err = max(
+                np.max(np.abs(np.interp(mids, grid, fids) - mf)),
+                np.max(np.abs(np.interp(mids, grid, probs) - mp)),
+                np.max(np.abs(np.interp(mids, grid, costs) - mc) / mc),
+            )
+            if err <= tol or 2*n - 1 > max_points:
+                break
+            n = 2*n - 1
+
+        table = LadderTable(rounds, grid, fids, probs, costs, err)
+        self._tables[key] = table
+        while len(self._tables) > self.table_maxsize:
+            self._tables.popitem(last=False)
+        return table
+
+    def clear(self) -> None:
+        self._tables.clear()
+        self.hits = 0
+        self.misses = 0
@@ -8,7 +8,10 @@ from enum import Enum
 from collections.abc import Iterable
 from copy import deepcopy
 
-from .types import Fidelity, ExpCost, OpResult
+import numpy as np
+
+from .types import Fidelity, Prob, ExpCost, OpResult
+from .ladder import PurifyLadder
 
 
 class EntType(Enum):
@@ -47,6 +50,15 @@ class HWParam:
         else:
             self.noisy = True
 
+    def key(self) -> 'tuple[float, ...]':
+        return tuple(float(param) for param in self.params)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, HWParam) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
 
 class Gate:
     def __init__(self, ent_type: EntType, hdw: HWParam) -> None:
@@ -61,6 +73,34 @@ class Gate:
             assert self.hw.noisy == False, \
                 "Noisy measurement not supported in dephased system"
 
+        self._ladder: PurifyLadder = None
+
+        # hardware constants shared by all werner kernels
+        p, eta = self.hw.p, self.hw.eta
+        self._p2 = p**2
+        self._p_m = (1-p**2)/(p**2) if p > 0 else float('inf')
+        self._eta_m = eta**2 + (1-eta)**2
+        self._eta_c = 2*eta*(1-eta)
+        # werner swap: f = 1/4 + _swap_w * (4*f1-1) * (4*f2-1)
+        self._swap_w = (1/36) * p * (4*eta**2-1)
+
+    def key(self) -> tuple:
+        # canonical signature, equal gates compute the same results
+        return (self.ent_type.name,) + self.hw.key()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Gate) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    @property
+    def ladder(self) -> PurifyLadder:
+        # purification ladder cache, created on first use
+        if self._ladder is None:
+            self._ladder = PurifyLadder(self)
+        return self._ladder
+
     def swap(self, f1, f2) -> 'OpResult':
         if self.ent_type == EntType.DEPHASED:
             f = self._swap_dephased(f1, f2)
@@ -72,12 +112,9 @@ class Gate:
         return f, self.hw.prob_swap
     
     def seq_swap(self, fids):
-        f = fids[0]
-        prob = 1
-        for i in range(1, len(fids)):
-            f, p = self.swap(f, fids[i])
-            prob *= p
-        return f, prob
+        # any swap chain collapses to the same closed form
+        f, prob = self.chain_swap(fids)
+        return float(f), float(prob)
     
     def seq_swap_grad(self, fids, partial):
         prod = 1
@@ -105,20 +142,75 @@ class Gate:
         return grad_f, grad_cn, 0
 
     def balanced_swap(self, fids: 'list[float]') -> 'OpResult':
-        assert len(fids) > 0
-        next_fids = []
-        prob = 1
-        while len(fids) > 1:
-            while len(fids) > 1:
-                f1, f2 = fids.pop(0), fids.pop(0)
-                f, p = self.swap(f1, f2)
-                next_fids.append(f)
-                prob *= p
+        # the tree shape does not change the result of a swap chain
+        f, prob = self.chain_swap(fids)
+        return float(f), float(prob)
 
-            fids = next_fids
-            next_fids = []
+    def swap_factor(self, f):
+        """
+        the multiplicative term of f in a swap chain:
+        (2f-1) for dephased, (4f-1) for werner
+        """
+        if self.ent_type == EntType.DEPHASED:
+            return 2*np.asarray(f, dtype=float) - 1
+        elif self.ent_type == EntType.WERNER:
+            return 4*np.asarray(f, dtype=float) - 1
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
 
-        return fids[0], prob
+    def swap_weight(self, f):
+        """
+        additive path weight of f: -log of its normalized swap factor,
+        (2f-1) for dephased, k*(4f-1) for werner, both <= 1,
+        so the path of min total weight has the max swapped fidelity
+        inf if the factor is not positive
+        """
+        factor = self.swap_factor(f)
+        if self.ent_type == EntType.WERNER:
+            factor = 4*self._swap_w * factor
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(factor > 0, -np.log(np.where(factor > 0, factor, 1)), np.inf)
+        return weight[()]
+
+    def chain_swap(self, fids, axis=-1) -> 'OpResult':
+        """
+        closed-form swap of all fidelities along axis, in any tree shape
+        dephased: 2f-1 = prod(2f_i-1)
+        werner: 4f-1 = k**(n-1) * prod(4f_i-1), k = p*(4*eta**2-1)/9
+        fids: list or ndarray, not modified
+        """
+        factors = np.moveaxis(self.swap_factor(fids), axis, -1)
+        n = factors.shape[-1]
+        assert n > 0
+        if self.ent_type == EntType.DEPHASED:
+            f = 1/2 + factors[..., 0] * np.prod(factors[..., 1:], axis=-1)/2
+        else:
+            # fold k into each swapped term so the product cannot overflow
+            k = 4*self._swap_w
+            f = 1/4 + factors[..., 0] * np.prod(k*factors[..., 1:], axis=-1)/4
+        prob = np.full(np.shape(f), self.hw.prob_swap ** (n-1))
+
+        return f[()], prob[()]
+
+    def chain_purify(self, fids, axis=-1) -> 'OpResult':
+        """
+        purify all fidelities along axis in a balanced tree
+        adjacent pairs are purified level by level,
+        an odd one at the end of a level is carried to the next level
+        fids: list or ndarray, not modified
+        """
+        level = np.moveaxis(np.asarray(fids, dtype=float), axis, -1)
+        assert level.shape[-1] > 0
+        prob = np.ones(level.shape[:-1])
+        while level.shape[-1] > 1:
+            m = level.shape[-1] // 2 * 2
+            f, p = self.purify_batch(level[..., 0:m:2], level[..., 1:m:2])
+            prob = prob * np.prod(p, axis=-1)
+            if m < level.shape[-1]:
+                f = np.concatenate([f, level[..., m:]], axis=-1)
+            level = f
+
+        return level[..., 0][()], prob[()]
 
     def purify(self, f1, f2) -> 'OpResult':
         if self.ent_type == EntType.DEPHASED:
@@ -137,23 +229,8 @@ class Gate:
         return f, prob
     
     def balanced_purify(self, fids: 'list[float]') -> 'OpResult':
-        assert len(fids) > 0
-        next_fids = []
-        prob = 1
-        while len(fids) > 1:
-            while len(fids) > 1:
-                fid1, fid2 = fids.pop(0), fids.pop(0)
-                f, p = self.purify(fid1, fid2)
-                next_fids.append(f)
-                prob *= p
-
-            if len(fids) == 1:
-                next_fids.append(fids.pop(0))
-
-            fids = next_fids
-            next_fids = []
-
-        return fids[0], prob
+        f, prob = self.chain_purify(fids)
+        return float(f), float(prob)
 
 
 
@@ -167,15 +244,148 @@ class Gate:
         
         return grad_f, grad_cn, grad_cf
 
+    def swap_fused(self, f1, f2) \
+            -> 'tuple[Fidelity, Prob, tuple[Fidelity, ExpCost, ExpCost], tuple[Fidelity, ExpCost, ExpCost]]':
+        """
+        swap and both partial grads in one evaluation
+        return f, prob, (grad_f, grad_cn, grad_cf) wrt f1, the same wrt f2
+        works on scalars and (broadcastable) ndarrays
+        """
+        if self.ent_type == EntType.DEPHASED:
+            f = self._swap_dephased(f1, f2)
+            g1, g2 = 2*f2 - 1, 2*f1 - 1
+        elif self.ent_type == EntType.WERNER:
+            x1, x2 = 4*f1 - 1, 4*f2 - 1
+            f = 1/4 + self._swap_w * x1 * x2
+            g1, g2 = 4*self._swap_w * x2, 4*self._swap_w * x1
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
+        grad_cn = 1/self.hw.prob_swap
+        return f, self.hw.prob_swap, (g1, grad_cn, 0), (g2, grad_cn, 0)
+
+    def purify_fused(self, f1, f2, n1, n2) \
+            -> 'tuple[Fidelity, Prob, tuple[Fidelity, ExpCost, ExpCost], tuple[Fidelity, ExpCost, ExpCost]]':
+        """
+        purify and both partial grads in one evaluation
+        return f, prob, (grad_f, grad_cn, grad_cf) wrt f1, the same wrt f2
+        the grads equal those of purify_grad(f1, f2, n1, n2, 1 or 2)
+        works on scalars and (broadcastable) ndarrays
+        """
+        if self.ent_type == EntType.DEPHASED:
+            return self._purify_dephased_fused(f1, f2, n1, n2)
+        elif self.ent_type == EntType.WERNER:
+            return self._purify_werner_fused(f1, f2, n1, n2)
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
+    def _purify_dephased_fused(self, f1, f2, n1, n2):
+        prob = f1*f2 + (1-f1)*(1-f2)
+        f = f1*f2 / prob
+        deno = prob**2
+        d1, d2 = 2*f2 - 1, 2*f1 - 1
+        grad_cn = 1/prob
+        g1 = ((f2*prob - f1*f2*d1) / deno, grad_cn, -(n1+n2)*d1 / deno)
+        g2 = ((f1*prob - f1*f2*d2) / deno, grad_cn, -(n1+n2)*d2 / deno)
+        return f, prob, g1, g2
+
+    def _purify_werner_fused(self, f1, f2, n1, n2):
+        e1, e2 = (1-f1)/3, (1-f2)/3
+        eta_m, eta_c, p_m = self._eta_m, self._eta_c, self._p_m
+
+        nume = eta_m*(f1*f2 + e1*e2) + eta_c*(f1*e2 + f2*e1) + p_m/8
+        deno = eta_m*(f1*f2 + f1*e2 + f2*e1 + 5*e1*e2) + eta_c*(2*f1*e2 + 2*f2*e1 + 4*e1*e2) + p_m/2
+        deno2 = deno**2
+        f = nume / deno
+        prob = deno * self._p2
+
+        # partial derivatives of nume & deno, d(e_i)/d(f_i) = -1/3
+        dn1 = eta_m*(f2 - e2/3) + eta_c*(e2 - f2/3)
+        dd1 = eta_m*(f2 + e2 - f2/3 - 5/3*e2) + eta_c*(2*e2 - 2/3*f2 - 4/3*e2)
+        dn2 = eta_m*(f1 - e1/3) + eta_c*(e1 - f1/3)
+        dd2 = eta_m*(f1 + e1 - f1/3 - 5/3*e1) + eta_c*(2*e1 - 2/3*f1 - 4/3*e1)
+
+        grad_cn = 1/deno
+        scale_cf = -(n1+n2) * self._p2 / deno2
+        g1 = ((dn1*deno - nume*dd1) / deno2, grad_cn, scale_cf*dd1)
+        g2 = ((dn2*deno - nume*dd2) / deno2, grad_cn, scale_cf*dd2)
+        return f, prob, g1, g2
+
+    @staticmethod
+    def _as_arrays(*values) -> 'list[np.ndarray]':
+        # broadcast scalars / lists / ndarrays to float arrays of one shape
+        arrays = [np.asarray(v, dtype=float) for v in values]
+        return np.broadcast_arrays(*arrays)
+
+    def swap_batch(self, f1, f2) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        vectorized swap over arrays of fidelities
+        f1 and f2 are broadcast against each other
+        return (fidelity, probability) arrays of the broadcast shape
+        """
+        f1, f2 = self._as_arrays(f1, f2)
+        if self.ent_type == EntType.DEPHASED:
+            f = self._swap_dephased(f1, f2)
+        elif self.ent_type == EntType.WERNER:
+            f = self._swap_werner(f1, f2)
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
+        prob = np.full(f.shape, self.hw.prob_swap, dtype=float)
+        return f, prob
+
+    def swap_grad_batch(self, f1, f2, partial) \
+            -> 'tuple[np.ndarray, np.ndarray, np.ndarray]':
+        """
+        vectorized swap_grad, return (grad_f, grad_cn, grad_cf) arrays
+        """
+        f1, f2 = self._as_arrays(f1, f2)
+        if self.ent_type == EntType.DEPHASED:
+            grad_f = self._swap_dephased_grad(f1, f2, partial)
+        elif self.ent_type == EntType.WERNER:
+            grad_f = self._swap_werner_grad(f1, f2, partial)
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
+        grad_f = np.broadcast_to(grad_f, f1.shape).astype(float)
+        grad_cn = np.full(f1.shape, 1/self.hw.prob_swap, dtype=float)
+        grad_cf = np.zeros(f1.shape, dtype=float)
+        return grad_f, grad_cn, grad_cf
+
+    def purify_batch(self, f1, f2) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        vectorized purify over arrays of fidelities
+        f1 and f2 are broadcast against each other
+        return (fidelity, probability) arrays of the broadcast shape
+        """
+        f1, f2 = self._as_arrays(f1, f2)
+        if self.ent_type == EntType.DEPHASED:
+            return self._purify_dephased(f1, f2)
+        elif self.ent_type == EntType.WERNER:
+            return self._purify_werner(f1, f2)
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
+    def purify_grad_batch(self, f1, f2, n1, n2, partial) \
+            -> 'tuple[np.ndarray, np.ndarray, np.ndarray]':
+        """
+        vectorized purify_grad, return (grad_f, grad_cn, grad_cf) arrays
+        f1, f2, n1 and n2 are broadcast against each other
+        """
+        f1, f2, n1, n2 = self._as_arrays(f1, f2, n1, n2)
+        if self.ent_type == EntType.DEPHASED:
+            return self._purify_dephased_grad(f1, f2, n1, n2, partial)
+        elif self.ent_type == EntType.WERNER:
+            return self._purify_werner_grad(f1, f2, n1, n2, partial)
+        else:
+            raise ValueError('ent_type must be DEPHASED or WERNER')
+
     def _swap_dephased(self, f1, f2) -> Fidelity:
         f = f1*f2 + (1-f1)*(1-f2)
         return f
     
     def _swap_werner(self, f1, f2) -> Fidelity:
-        p = self.hw.p
-        eta = self.hw.eta
-        
-        f = 1/4 + (1/36) * p * (4*eta**2-1) * (4*f1 - 1) * (4*f2 - 1)
+        f = 1/4 + self._swap_w * (4*f1 - 1) * (4*f2 - 1)
         return f
 
     def _swap_dephased_grad(self, f1, f2, partial) -> Fidelity:
@@ -188,13 +398,10 @@ class Gate:
         return grad_f
 
     def _swap_werner_grad(self, f1, f2, partial) -> Fidelity:
-        p = self.hw.p
-        eta = self.hw.eta
-
         if partial == 1:
-            grad = (1/9) * p * (4*eta**2-1) * (4*f2 - 1)
+            grad = 4*self._swap_w * (4*f2 - 1)
         elif partial == 2:
-            grad = (1/9) * p * (4*eta**2-1) * (4*f1 - 1)
+            grad = 4*self._swap_w * (4*f1 - 1)
         else:
             raise ValueError('p must be 1 or 2')
         return grad
@@ -206,14 +413,13 @@ class Gate:
 
     def _purify_werner(self, f1, f2) -> 'OpResult':
         e1, e2 = (1-f1)/3, (1-f2)/3
-        p = self.hw.p
-        eta = self.hw.eta
+        eta_m, eta_c, p_m = self._eta_m, self._eta_c, self._p_m
 
-        nume = (eta**2 + (1-eta)**2)*(f1*f2 + e1*e2) + 2*eta*(1-eta)*(f1*e2 + f2*e1) + (1-p**2)/(8*p**2)
-        deno = (eta**2 + (1-eta)**2)*(f1*f2 + f1*e2 + f2*e1 + 5*e1*e2) + 2*eta*(1-eta)*(2*f1*e2 + 2*f2*e1 + 4*e1*e2) + (1-p**2)/(2*p**2)
+        nume = eta_m*(f1*f2 + e1*e2) + eta_c*(f1*e2 + f2*e1) + p_m/8
+        deno = eta_m*(f1*f2 + f1*e2 + f2*e1 + 5*e1*e2) + eta_c*(2*f1*e2 + 2*f2*e1 + 4*e1*e2) + p_m/2
         
         f = nume / deno
-        prob = deno * p**2
+        prob = deno * self._p2
         return f, prob
 
     def _purify_dephased_grad(self, f1, f2, n1, n2, partial) \
@@ -235,25 +441,21 @@ class Gate:
     def _purify_werner_grad(self, f1, f2, n1, n2, partial) \
             -> 'tuple[Fidelity, ExpCost, ExpCost]':
         e1, e2 = (1-f1)/3, (1-f2)/3
-        p = self.hw.p
-        eta = self.hw.eta
-
-        eta_m = (eta**2 + (1-eta)**2)
-        p_m = (1-p**2)/(p**2)
+        eta_m, eta_c, p_m = self._eta_m, self._eta_c, self._p_m
         
-        nume_purify = eta_m*(f1*f2 + e1*e2) + 2*eta*(1-eta)*(f1*e2 + f2*e1) + p_m/8
-        deno_purify = eta_m*(f1*f2 + f1*e2 + f2*e1 + 5*e1*e2) + 2*eta*(1-eta)*(2*f1*e2 + 2*f2*e1 + 4*e1*e2) + p_m/2
+        nume_purify = eta_m*(f1*f2 + e1*e2) + eta_c*(f1*e2 + f2*e1) + p_m/8
+        deno_purify = eta_m*(f1*f2 + f1*e2 + f2*e1 + 5*e1*e2) + eta_c*(2*f1*e2 + 2*f2*e1 + 4*e1*e2) + p_m/2
         deno = deno_purify ** 2
         if partial == 1:
-            p_nume_purify_1 = eta_m*(f2 - (1/3)*e2) + 2*eta*(1-eta)*(e2-1/3*f2)
-            p_deno_purify_1 = eta_m*(f2 + e2 -1/3*f2 - (5/3)*e2) + 2*eta*(1-eta)*(2*e2 - 2/3*f2 - 4/3*e2)
+            p_nume_purify_1 = eta_m*(f2 - (1/3)*e2) + eta_c*(e2-1/3*f2)
+            p_deno_purify_1 = eta_m*(f2 + e2 -1/3*f2 - (5/3)*e2) + eta_c*(2*e2 - 2/3*f2 - 4/3*e2)
             nume = p_nume_purify_1 * deno_purify - nume_purify * p_deno_purify_1
-            grad_cf = (n1+n2)*(-1/deno)*(p**2*p_deno_purify_1)
+            grad_cf = (n1+n2)*(-1/deno)*(self._p2*p_deno_purify_1)
         elif partial == 2:
-            p_nume_purify_2 = eta_m*(f1 - (1/3)*e1) + 2*eta*(1-eta)*(e1-1/3*f1)
-            p_deno_purify_2 = eta_m*(f1 + e1 -1/3*f1 - (5/3)*e1) + 2*eta*(1-eta)*(2*e1 - 2/3*f1 - 4/3*e1)
+            p_nume_purify_2 = eta_m*(f1 - (1/3)*e1) + eta_c*(e1-1/3*f1)
+            p_deno_purify_2 = eta_m*(f1 + e1 -1/3*f1 - (5/3)*e1) + eta_c*(2*e1 - 2/3*f1 - 4/3*e1)
             nume = p_nume_purify_2 * deno_purify - nume_purify * p_deno_purify_2
-            grad_cf = (n1+n2)*(-1/deno)*(p**2*p_deno_purify_2)
+            grad_cf = (n1+n2)*(-1/deno)*(self._p2*p_deno_purify_2)
         else:
             raise ValueError('p must be 1 or 2')
 
@@ -1,9 +1,94 @@
 
 from abc import ABC, abstractmethod
+import time
 
 from ..physical import StaticQuPath
 from ..physical import quantum as qu
 from .utils.types import ExpAlloc
+from .utils.tree import TreeNode
+
+
+class Deadline:
+    """
+    Wall-clock and/or iteration budget of an anytime solve
+    seconds: time allowed from start(), None for no limit
+    max_iters: iterations allowed, None for no limit
+    cancel: polled by expired(), return True to preempt the solve
+    cancel() may also be called from another thread
+    """
+
+    def __init__(self, seconds: float=None, max_iters: int=None,
+            cancel: 'callable'=None) -> None:
+        self.seconds = seconds
+        self.max_iters = max_iters
+        self.hook = cancel
+
+        self.iters = 0
+        self.started: float = None
+        self.cancelled = False
+
+    def start(self) -> 'Deadline':
+        if self.started is None:
+            self.started = time.perf_counter()
+        return self
+
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return time.perf_counter() - self.started
+
+    def tick(self, n: int=1) -> None:
+        self.iters += n
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def expired(self) -> bool:
+        self.start()
+        if self.cancelled:
+            return True
+        if self.hook is not None and self.hook():
+            self.cancelled = True
+            return True
+        if self.max_iters is not None and self.iters >= self.max_iters:
+            return True
+        return self.seconds is not None and self.elapsed() >= self.seconds
+
+
+class AnytimeResult:
+    """
+    Best scheme found within a Deadline, with its quality bounds
+    complete: the solver finished, the result is what solve() returns
+    """
+
+    def __init__(self, alloc: ExpAlloc, root: TreeNode, target_fid: qu.Fidelity,
+            complete: bool, deadline: Deadline) -> None:
+        self.alloc = alloc
+        self.root = root
+        self.fid = root.fid if root is not None else None
+        self.cost = root.cost if root is not None else sum(alloc.values())
+        self.target_fid = target_fid
+        self.complete = complete
+        self.iters = deadline.iters
+        self.elapsed = deadline.elapsed()
+
+    @property
+    def feasible(self) -> bool:
+        return self.fid is not None and self.fid >= self.target_fid
+
+    @property
+    def fid_gap(self) -> float:
+        # how far the root fid is below the target, 0 if feasible
+        if self.fid is None:
+            return float('inf')
+        return max(0.0, self.target_fid - self.fid)
+
+    def __str__(self) -> str:
+        s = 'fid=none' if self.fid is None else f'fid={self.fid:.4f}'
+        s += f' (target {self.target_fid:.4f}), cost={self.cost:.4f}, '
+        s += f'{"complete" if self.complete else "partial"} after {self.iters} iters, '
+        s += f'{self.elapsed:.3f}s'
+        return s
 
 
 class PathSolver(ABC):
@@ -13,4 +98,15 @@ class PathSolver(ABC):
 
     @abstractmethod
     def solve(self) -> ExpAlloc:
-        pass
\ No newline at end of file
+        pass
+
+    def solve_anytime(self, deadline: Deadline) -> AnytimeResult:
+        """
+        best scheme found before the deadline
+        solvers that cannot be preempted run solve() to the end
+        """
+        deadline.start()
+        alloc = self.solve()
+        tree = getattr(self, 'tree', None)
+        root = tree.root if tree is not None else None
+        return AnytimeResult(alloc, root, getattr(self, 'target_fid', 0.0), True, deadline)
\ No newline at end of file
@@ -0,0 +1,200 @@
+
+
+# memoization of path solvers
+# a solution only depends on the gate, the leaf fids & costs and the
+# solver settings, not on the edge names, so it is stored per leaf
+# position and mapped back onto the edges of each path
+
+
+import inspect
+from collections import OrderedDict
+
+from ..physical import quantum as qu
+from .base import PathSolver
+from .utils.tree import TreeNode
+from .utils.types import ExpAlloc, TreeShape
+
+
+def solver_params(solver: PathSolver) -> tuple:
+    """
+    the constructor settings of a solver (target_fid, budget, shape, ...)
+    edges & gate are keyed by path_key, state set by solve() is not keyed
+    """
+    params = []
+    signature = inspect.signature(type(solver).__init__)
+    for name, param in signature.parameters.items():
+        if name in ('self', 'edges', 'gate') \
+                or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        params.append((name, getattr(solver, name, param.default)))
+    return (type(solver).__name__,) + tuple(params)
+
+
+def slice_invariant(solver: PathSolver) -> bool:
+    """
+    the solution of any slice spanned by a subtree is that subtree:
+    a plain swap tree of a fixed shape, no target fid and no budget
+    a target or budget purifies each slice for the whole path instead
+    """
+    target = getattr(solver, 'target_fid', None)
+    budget = getattr(solver, 'budget', float('inf'))
+    shape = getattr(solver, 'shape', None)
+    return (target is None or target <= 0) and budget == float('inf') \
+        and shape in (TreeShape.LINKED, TreeShape.BALANCED)
+
+
+def path_key(gate: qu.Gate, fids: 'list[qu.Fidelity]', shape=None,
+        costs: 'list[qu.ExpCost]'=None, params: tuple=(), decimals: int=6) -> tuple:
+    """
+    canonical signature of a path problem: (group, leaves)
+    leaves are the (quantized fid, cost) of each position,
+    the group is everything else
+    """
+    if costs is None:
+        costs = [1.0] * len(fids)
+    scale = 10 ** decimals
+    qfids = (int(round(f * scale)) for f in fids)
+    leaves = tuple(zip(qfids, (float(c) for c in costs)))
+    return (gate.key(), shape, params), leaves
+
+
+class SolutionCache:
+    """
+    LRU cache of solutions keyed by (gate, shape, solver settings)
+    and the quantized fid & cost of every leaf
+    values are the expected costs of the leaves, by position
+    reuse_slices: a path that is a contiguous slice of a cached path
+        and is spanned by one subtree of its tree reuses that subtree,
+        only for slice_invariant solvers
+    """
+
+    def __init__(self, maxsize: int=4096, decimals: int=6, reuse_slices: bool=False) -> None:
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.reuse_slices = reuse_slices
+
+        self._entries: 'OrderedDict[tuple, list[qu.ExpCost]]' = OrderedDict()
+        # (group, leaves of a slice) -> (key, i, j, scale of the subtree root)
+        self._slices: 'dict[tuple, tuple]' = {}
+        # key -> cost of each leaf for one root pair of its tree
+        self._bases: 'dict[tuple, list[qu.ExpCost]]' = {}
+        # key -> its slice keys, dropped with the entry
+        self._slice_keys: 'dict[tuple, list[tuple]]' = {}
+
+        self.hits = 0
+        self.slice_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, gate: qu.Gate, fids: 'list[qu.Fidelity]', shape=None,
+            costs: 'list[qu.ExpCost]'=None, params: tuple=()) -> tuple:
+        return path_key(gate, fids, shape, costs, params, self.decimals)
+
+    def get(self, key: tuple) -> 'list[qu.ExpCost]':
+        values = self._entries.get(key)
+        if values is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return values
+
+        if self.reuse_slices:
+            found = self._slices.get(key)
+            if found is not None:
+                self._entries.move_to_end(found[0])
+                self.slice_hits += 1
+                key, i, j, scale = found
+                return [c * scale for c in self._bases[key][i:j+1]]
+
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple, values: 'list[qu.ExpCost]', root: TreeNode=None,
+            edges: 'list[tuple]'=None) -> None:
+        """
+        root & edges: the solved tree and the path edges by position,
+            to index its subtrees when reuse_slices is on
+        """
+        if key in self._entries:
+            self._drop_slices(key)
+        self._entries[key] = list(values)
+        self._entries.move_to_end(key)
+        if self.reuse_slices and root is not None:
+            self._index_slices(key, root, edges)
+
+        while len(self._entries) > self.maxsize:
+            old, _ = self._entries.popitem(last=False)
+            self._drop_slices(old)
+
+    def _index_slices(self, key: tuple, root: TreeNode, edges: 'list[tuple]') -> None:
+        group, leaves = key
+        position = {edge: i for i, edge in enumerate(edges)}
+
+        # pre-order with an explicit stack, deep LINKED trees are fine
+        # scale: product of the probs above a node, the cost of a leaf
+        # for one pair at node is its cost for the root times that scale
+        order: 'list[tuple[TreeNode, float]]' = []
+        stack = [(root, 1.0)]
+        while len(stack) > 0:
+            node, scale = stack.pop()
+            order.append((node, scale))
+            if not node.is_leaf():
+                stack.append((node.right, scale * node.prob))
+                stack.append((node.left, scale * node.prob))
+
+        base = [0.0] * len(edges)
+        span: 'dict[int, tuple[int, int]]' = {}
+        slice_keys = []
+        for node, scale in reversed(order):
+            if node.is_leaf():
+                i = position[node.edge_tuple]
+                base[i] = node.cost / scale
+                span[id(node)] = (i, i)
+                continue
+            li, lj = span.pop(id(node.left))
+            ri, rj = span.pop(id(node.right))
+            i, j = min(li, ri), max(lj, rj)
+            span[id(node)] = (i, j)
+            if j > i and (i, j) != (0, len(edges) - 1):
+                skey = (group, leaves[i:j+1])
+                if skey not in self._slices:
+                    self._slices[skey] = (key, i, j, scale)
+                    slice_keys.append(skey)
+
+        self._bases[key] = base
+        self._slice_keys[key] = slice_keys
+
+    def _drop_slices(self, key: tuple) -> None:
+        self._bases.pop(key, None)
+        for skey in self._slice_keys.pop(key, []):
+            del self._slices[skey]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._slices.clear()
+        self._bases.clear()
+        self._slice_keys.clear()
+        self.hits = 0
+        self.slice_hits = 0
+        self.misses = 0
+
+    def solve(self, solver: PathSolver) -> ExpAlloc:
+        """
+        solver.solve() unless an equal path problem has been solved
+        solvers start every leaf at cost 1, the default costs of the key
+        """
+        edges = [edge for edge, _ in solver.edges]
+        fids = [fid for _, fid in solver.edges]
+        shape = getattr(solver, 'shape', None)
+        key = self.key(solver.gate, fids, shape, None, solver_params(solver))
+
+        values = self.get(key)
+        if values is not None:
+            return dict(zip(edges, values))
+
+        alloc = solver.solve()
+        tree = getattr(solver, 'tree', None)
+        root = tree.root if tree is not None and slice_invariant(solver) else None
+        self.put(key, [alloc[edge] for edge in edges], root, edges)
+        return alloc
@@ -0,0 +1,145 @@
+
+
+# solve all paths of a QuNetTask on a process pool
+# leaf fids of all paths are packed in one shared memory block,
+# workers receive only path indices and return leaf costs by position
+
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import heapq
+import inspect
+import os
+
+import numpy as np
+
+from ..physical import quantum as qu
+from .utils.types import ExpAlloc
+
+
+# per-worker state, set by _init_worker
+_worker: dict = {}
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the parent owns the block and unlinks it, workers only map it
+    # (before 3.13 workers register it with the parent's resource tracker,
+    # which is idempotent, so the parent's unlink still cleans up)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _init_worker(name: str, n_fids: int, n_paths: int, solver_cls: type,
+        gate: qu.Gate, solver_kwargs: dict) -> None:
+    shm = _attach(name)
+    buf = np.ndarray(n_fids + 2*n_paths + 1, dtype=np.float64, buffer=shm.buf)
+    _worker.update(shm=shm, fids=buf[:n_fids], offsets=buf[n_fids:n_fids + n_paths + 1],
+        targets=buf[n_fids + n_paths + 1:], solver_cls=solver_cls, gate=gate,
+        kwargs=solver_kwargs)
+
+
+def _solve_path(fids: np.ndarray, target: float, solver_cls: type, gate: qu.Gate,
+        kwargs: dict) -> np.ndarray:
+    # solve on placeholder edges (i, i+1), return leaf costs by position
+    edges = tuple(((i, i + 1), float(f)) for i, f in enumerate(fids))
+    if not np.isnan(target):
+        kwargs = dict(kwargs, target_fid=float(target))
+    alloc = solver_cls(edges, gate, **kwargs).solve()
+    return np.array([alloc.get(edge, 0.0) for edge, _ in edges])
+
+
+def _solve_chunk(indices: 'list[int]') -> 'list[tuple[int, np.ndarray]]':
+    fids, offsets, targets = _worker['fids'], _worker['offsets'], _worker['targets']
+    out = []
+    for k in indices:
+        lo, hi = int(offsets[k]), int(offsets[k + 1])
+        out.append((k, _solve_path(fids[lo:hi], targets[k], _worker['solver_cls'],
+            _worker['gate'], _worker['kwargs'])))
+    return out
+
+
+def _chunks(lengths: np.ndarray, workers: int, chunksize: int=None) -> 'list[list[int]]':
+    """
+    path indices in chunks of about equal total length (the work estimate):
+    longest first, each path goes to the chunk with the least length so far
+    """
+    order = np.argsort(-lengths, kind='stable')
+    if chunksize is None:
+        # a few chunks per worker, so the pool can balance the rest
+        chunksize = max(1, len(order) // (4 * workers))
+    n_chunks = -(-len(order) // chunksize)
+    chunks: 'list[list[int]]' = [[] for _ in range(n_chunks)]
+    heap = [(0, c) for c in range(n_chunks)]
+    for k in order.tolist():
+        load, c = heapq.heappop(heap)
+        chunks[c].append(k)
+        heapq.heappush(heap, (load + int(lengths[k]), c))
+    return chunks
+
+
+def solve_many(task, solver_cls: type, workers: int=None, solver_kwargs: dict=None,
+        gate: qu.Gate=None, chunksize: int=None) -> 'dict[tuple, list[ExpAlloc]]':
+    """
+    solve every path in task.up_paths with solver_cls(edges, gate, **solver_kwargs)
+    target_fid is taken from task.fid_req for each user pair
+    unless given in solver_kwargs (and the solver accepts one)
+    return the ExpAlloc of each path, by user pair
+    """
+    solver_kwargs = dict(solver_kwargs or {})
+    if gate is None:
+        gate = task.qunet.gate
+    if workers is None:
+        workers = os.cpu_count()
+
+    keys, edges, fid_list, targets = [], [], [], []
+    params = inspect.signature(solver_cls).parameters
+    wants_target = 'target_fid' in params and 'target_fid' not in solver_kwargs
+    needs_target = wants_target and params['target_fid'].default is inspect.Parameter.empty
+    for user_pair, paths in task.up_paths.items():
+        for path in paths:
+            keys.append(user_pair)
+            edges.append(list(path))
+            fid_list.append([task.net.edges[edge]['obj'].fid for edge in path])
+            fid_req = getattr(task, 'fid_req', {}).get(user_pair)
+            if needs_target and fid_req is None:
+                raise ValueError(f'no fid_req for user pair {user_pair}, '
+                    f'{solver_cls.__name__} needs a target_fid')
+            targets.append(fid_req if wants_target and fid_req is not None else np.nan)
+
+    lengths = np.array([len(f) for f in fid_list], dtype=np.int64)
+    offsets = np.zeros(len(fid_list) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    results: 'dict[int, np.ndarray]' = {}
+
+    if workers <= 1 or len(fid_list) <= 1:
+        for k, fids in enumerate(fid_list):
+            results[k] = _solve_path(np.array(fids), targets[k], solver_cls, gate, solver_kwargs)
+    else:
+        n_fids, n_paths = int(offsets[-1]), len(fid_list)
+        size = (n_fids + 2*n_paths + 1) * 8
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            buf = np.ndarray(n_fids + 2*n_paths + 1, dtype=np.float64, buffer=shm.buf)
+            buf[:n_fids] = np.concatenate([np.asarray(f, dtype=float) for f in fid_list]) \
+                if n_fids > 0 else []
+            buf[n_fids:n_fids + n_paths + 1] = offsets
+            buf[n_fids + n_paths + 1:] = targets
+            del buf
+
+            chunks = _chunks(lengths, workers, chunksize)
+            with ProcessPoolExecutor(min(workers, len(chunks)), initializer=_init_worker,
+                    initargs=(shm.name, n_fids, n_paths, solver_cls, gate, solver_kwargs)) as pool:
+                futures = [pool.submit(_solve_chunk, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    for k, values in future.result():
+                        results[k] = values
+        finally:
+            shm.close()
+            shm.unlink()
+
+    out: 'dict[tuple, list[ExpAlloc]]' = {user_pair: [] for user_pair in task.up_paths}
+    for k, user_pair in enumerate(keys):
+        out[user_pair].append(dict(zip(edges[k], results[k].tolist())))
+    return out
@@ -0,0 +1,239 @@
+
+
+# on-disk store of path solutions, shared by runs and worker processes
+# a SQLite database in WAL mode: reads take no lock, writers wait
+# for each other up to the busy timeout
+# rows are evicted least recently used first once the store is too large
+# a hit only buffers its last-used time, the buffer is written in one
+# transaction by the next put, by flush() or once it holds flush_every keys
+# meta.bytes is the running total of the row sizes, kept by every write
+
+
+import hashlib
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from ..physical import quantum as qu
+from .base import PathSolver
+from .cache import path_key, solver_params
+from .utils import serialize
+from .utils.tree import TreeNode
+from .utils.types import ExpAlloc
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS solutions (
+    key TEXT PRIMARY KEY,
+    tree BLOB,
+    alloc BLOB NOT NULL,
+    fid REAL,
+    cost REAL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta
+    SELECT 'bytes', COALESCE(SUM(size), 0) FROM solutions;
+"""
+
+
+class StoredSolution:
+    """
+    a solution read from the store, the tree is decoded on access
+    """
+
+    def __init__(self, tree: bytes, values: 'list[qu.ExpCost]',
+            fid: qu.Fidelity, cost: qu.ExpCost) -> None:
+        self._tree = tree
+        self.values = values
+        self.fid = fid
+        self.cost = cost
+
+    @property
+    def root(self) -> TreeNode:
+        if self._tree is None:
+            return None
+        return serialize.from_bytes(self._tree)[0]
+
+
+class SolutionStore:
+    """
+    SQLite store of solutions keyed by the digest of cache.path_key
+    safe to use from a process pool: every process opens its own connection
+    max_bytes: bound of the stored payloads, LRU rows beyond it are evicted
+    flush_every: hits buffered before their last-used times are written
+    """
+
+    def __init__(self, path: str, max_bytes: int=1 << 30, decimals: int=6,
+            timeout: float=30.0, flush_every: int=256) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.timeout = timeout
+        self.flush_every = flush_every
+
+        self._conn: sqlite3.Connection = None
+        self._pid: int = None
+        # key -> last-used time of the hits not yet written
+        self._used: 'dict[str, float]' = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        # connections are per process, never pickled
+        state = self.__dict__.copy()
+        state['_conn'], state['_pid'] = None, None
+        state['_used'] = {}
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            if self._pid is not None:
+                # a forked copy, the hits are the parent's to write
+                self._used = {}
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None and self._pid == os.getpid():
+            self.flush()
+            self._conn.close()
+        self._conn, self._pid = None, None
+
+    def __len__(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def nbytes(self) -> int:
+        return self.conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+    @staticmethod
+    def digest(key: tuple) -> str:
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def key(self, gate: qu.Gate, fids: 'list[qu.Fidelity]', shape=None,
+            costs: 'list[qu.ExpCost]'=None, params: tuple=()) -> str:
+        return self.digest(path_key(gate, fids, shape, costs, params, self.decimals))
+
+    def get(self, key: str) -> StoredSolution:
+        row = self.conn.execute(
+            'SELECT tree, alloc, fid, cost FROM solutions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used[key] = time.time()
+        if len(self._used) >= self.flush_every:
+            self.flush()
+        tree, alloc, fid, cost = row
+        return StoredSolution(tree, np.frombuffer(alloc, dtype=np.float64).tolist(), fid, cost)
+
+    def put(self, key: str, values: 'list[qu.ExpCost]', root: TreeNode=None) -> None:
+        """
+        values: expected cost of each leaf by position
+        root: the solved tree, kept with its fid & cost
+        """
+        tree = serialize.to_bytes([root]) if root is not None else None
+        alloc = np.asarray(values, dtype=np.float64).tobytes()
+        fid = root.fid if root is not None else None
+        cost = root.cost if root is not None else float(np.sum(values))
+        size = len(alloc) + (len(tree) if tree is not None else 0)
+
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._write_used(conn)
+            old = conn.execute('SELECT size FROM solutions WHERE key = ?', (key,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, tree, alloc, fid, cost, size, time.time()))
+            self._add_bytes(conn, size - (old[0] if old is not None else 0))
+            self._evict(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def flush(self) -> None:
+        """
+        write the buffered last-used times of the hits
+        """
+        if len(self._used) == 0:
+            return
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._write_used(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _write_used(self, conn: sqlite3.Connection) -> None:
+        # inside a write transaction, rows evicted meanwhile are skipped
+        conn.executemany('UPDATE solutions SET used = ? WHERE key = ?',
+            [(used, key) for key, used in self._used.items()])
+        self._used.clear()
+
+    @staticmethod
+    def _add_bytes(conn: sqlite3.Connection, delta: int) -> None:
+        conn.execute("UPDATE meta SET value = value + ? WHERE name = 'bytes'", (delta,))
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # drop least recently used rows until the payloads fit
+        total = conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        drop = []
+        freed = 0
+        for key, size in conn.execute('SELECT key, size FROM solutions ORDER BY used'):
+            drop.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany('DELETE FROM solutions WHERE key = ?', drop)
+        self._add_bytes(conn, -freed)
+
+    def clear(self) -> None:
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM solutions')
+            conn.execute("UPDATE meta SET value = 0 WHERE name = 'bytes'")
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._used.clear()
+
+    def solve(self, solver: PathSolver) -> ExpAlloc:
+        """
+        solver.solve() unless the store has the solution, see SolutionCache.solve
+        """
+        edges = [edge for edge, _ in solver.edges]
+        fids = [fid for _, fid in solver.edges]
+        shape = getattr(solver, 'shape', None)
+        key = self.key(solver.gate, fids, shape, None, solver_params(solver))
+
+        found = self.get(key)
+        if found is not None:
+            return dict(zip(edges, found.values))
+
+        alloc = solver.solve()
+        tree = getattr(solver, 'tree', None)
+        root = tree.root if tree is not None else None
+        self.put(key, [alloc[edge] for edge in edges], root)
+        return alloc
@@ -0,0 +1,442 @@
+
+
+import numpy as np
+
+from ...physical.network import EdgeTuple
+from ...physical import quantum as qu
+from ..utils.tree import TreeNode, Leaf, Branch, MetaTree
+from ..utils.types import TreeShape, OP_LEAF, OP_SWAP, OP_PURIFY
+from .interval import INTERVAL_DP
+
+
+class ArraySPST:
+    """
+    Struct-of-arrays Swap Purification Scheme Tree
+    node i is the i-th entry of every array,
+    parent/left/right are node indices, -1 for none
+    the operations mirror those of SPST, but take & return node indices
+    """
+
+    INT_FIELDS = ('parent', 'left', 'right')
+    FLOAT_FIELDS = ('fid', 'prob', 'cost', 'grad_f', 'grad_cn', 'grad_cf',
+                    'efficiency', 'adjust_eff')
+
+    def __init__(self, leaves: 'dict[EdgeTuple, float]', gate: 'qu.Gate'=qu.GDP,
+            capacity: int=None) -> None:
+        self.leaves = leaves
+        self.gate = gate
+
+        self.edges = list(self.leaves.keys())
+        self.fids = list(self.leaves.values())
+
+        self.root = -1
+        self.size = 0
+        self.capacity = 0
+        if capacity is None:
+            capacity = max(1, 2 * len(self.edges))
+        self._grow(capacity)
+
+    def _grow(self, capacity: int) -> None:
+        def resized(arr: np.ndarray, shape, dtype) -> np.ndarray:
+            new = np.empty(shape, dtype=dtype)
+            if arr is not None:
+                new[:self.size] = arr[:self.size]
+            return new
+
+        for name in self.INT_FIELDS:
+            setattr(self, name, resized(getattr(self, name, None), capacity, np.int64))
+        for name in self.FLOAT_FIELDS:
+            setattr(self, name, resized(getattr(self, name, None), capacity, float))
+        self.op = resized(getattr(self, 'op', None), capacity, np.int8)
+        self.edge = resized(getattr(self, 'edge', None), (capacity, 2), np.int64)
+        self.capacity = capacity
+
+    def _new(self, k: int) -> np.ndarray:
+        """
+        allocate k detached nodes with default values
+        """
+        if self.size + k > self.capacity:
+            self._grow(max(2 * self.capacity, self.size + k))
+        idx = np.arange(self.size, self.size + k)
+        self.size += k
+
+        for name in self.INT_FIELDS:
+            getattr(self, name)[idx] = -1
+        for name in self.FLOAT_FIELDS:
+            getattr(self, name)[idx] = 1
+        self.op[idx] = OP_LEAF
+        return idx
+
+    def _merge(self, left: np.ndarray, right: np.ndarray, op: int) -> np.ndarray:
+        """
+        create one branch per (left[k], right[k]) pair
+        """
+        new = self._new(len(left))
+        self.left[new] = left
+        self.right[new] = right
+        self.parent[left] = new
+        self.parent[right] = new
+        self.op[new] = op
+        if op == OP_SWAP:
+            self.edge[new, 0] = self.edge[left, 0]
+            self.edge[new, 1] = self.edge[right, 1]
+            f, p = self.gate.swap_batch(self.fid[left], self.fid[right])
+        else:
+            self.edge[new] = self.edge[right]
+            f, p = self.gate.purify_batch(self.fid[left], self.fid[right])
+        self.fid[new] = f
+        self.prob[new] = p
+        self.cost[new] = (self.cost[left] + self.cost[right]) / p
+        return new
+
+    def build_sst(self, shape=TreeShape.BALANCED, costs: 'list[qu.ExpCost]'=None) -> int:
+        """
+        Build the SST with initial leaves, return the root index
+        costs: overide costs is not None
+        """
+        self.size = 0
+        leaves = self._new(len(self.edges))
+        self.edge[leaves] = np.array(self.edges, dtype=np.int64).reshape(-1, 2)
+        self.fid[leaves] = self.fids
+        if costs is not None:
+            self.cost[leaves] = costs
+
+        if shape == TreeShape.BALANCED:
+            nodes = leaves
+            while len(nodes) > 1:
+                m = len(nodes) // 2 * 2
+                merged = self._merge(nodes[0:m:2], nodes[1:m:2], OP_SWAP)
+                nodes = np.concatenate([merged, nodes[m:]])
+            self.root = nodes[0]
+        elif shape == TreeShape.LINKED:
+            node = leaves[:1]
+            for i in range(1, len(leaves)):
+                node = self._merge(node, leaves[i:i+1], OP_SWAP)
+            self.root = node[0]
+        elif shape == TreeShape.ST_OPT:
+            merges = MetaTree.greedy_merges(self.cost[leaves].tolist(), self.gate.hw.prob_swap)
+            self.root = self._apply_merges(leaves, merges)
+        elif shape == TreeShape.ST_DP:
+            _, K = INTERVAL_DP.solve(self.cost[leaves].tolist(), self.gate.hw.prob_swap)
+            self.root = self._apply_merges(leaves, self._dp_merges(K))
+        else:
+            raise NotImplementedError('shape not implemented')
+
+        self.root = int(self.root)
+        return self.root
+
+    @staticmethod
+    def _dp_merges(K: np.ndarray) -> 'list[tuple[int, int]]':
+        """
+        merges of the interval DP tree, in the format of MetaTree.greedy_merges:
+        node k >= n is the k-th merge, children before parents
+        """
+        n = len(K)
+        merges = []
+        built: 'dict[tuple[int, int], int]' = {}
+        stack = [(0, n - 1, False)]
+        while len(stack) > 0:
+            i, j, expanded = stack.pop()
+            if i == j:
+                built[(i, j)] = i
+                continue
+            k = int(K[i, j])
+            if not expanded:
+                stack.append((i, j, True))
+                stack.append((k + 1, j, False))
+                stack.append((i, k, False))
+                continue
+            merges.append((built.pop((i, k)), built.pop((k + 1, j))))
+            built[(i, j)] = n + len(merges) - 1
+        return merges
+
+    def _apply_merges(self, leaves: np.ndarray, merges: 'list[tuple[int, int]]') -> int:
+        # swap the merged pairs, merges of the same height at once
+        n = len(leaves)
+        merges = np.array(merges, dtype=np.int64).reshape(-1, 2)
+        height = np.zeros(n + len(merges), dtype=np.int64)
+        for k, (i, j) in enumerate(merges.tolist()):
+            height[n + k] = 1 + max(height[i], height[j])
+        index = np.empty(n + len(merges), dtype=np.int64)
+        index[:n] = leaves
+        for h in range(1, height.max() + 1):
+            ks = np.nonzero(height[n:] == h)[0]
+            index[n + ks] = self._merge(index[merges[ks, 0]], index[merges[ks, 1]], OP_SWAP)
+        return index[-1]
+
+    def levels(self, node: int=None) -> 'list[np.ndarray]':
+        """
+        node indices of the subtree, level by level from the given node
+        """
+        if node is None:
+            node = self.root
+        frontier = np.array([node])
+        levels = []
+        while len(frontier) > 0:
+            levels.append(frontier)
+            branches = frontier[self.op[frontier] != OP_LEAF]
+            frontier = np.concatenate([self.left[branches], self.right[branches]])
+        return levels
+
+    def subtree(self, node: int=None) -> np.ndarray:
+        return np.concatenate(self.levels(node))
+
+    def preorder_rank(self, node: int=None) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        (nodes, rank) where rank is the pre-order position in the subtree
+        """
+        levels = self.levels(node)
+        nodes = np.concatenate(levels)
+        size = np.zeros(self.size, dtype=np.int64)
+        size[nodes] = 1
+        for level in reversed(levels[:-1]):
+            br = level[self.op[level] != OP_LEAF]
+            size[br] += size[self.left[br]] + size[self.right[br]]
+
+        pos = np.zeros(self.size, dtype=np.int64)
+        for level in levels[:-1]:
+            br = level[self.op[level] != OP_LEAF]
+            pos[self.left[br]] = pos[br] + 1
+            pos[self.right[br]] = pos[br] + 1 + size[self.left[br]]
+        return nodes, pos[nodes]
+
+    def grad(self, node: int=None, grad_f: qu.Fidelity=1,
+            grad_cn: qu.ExpCost=1, grad_cf: qu.ExpCost=1) -> None:
+        """
+        Calculate the grads of all descendants, wrt the given node
+        level by level, each level in one vectorized kernel call per op
+        """
+        if node is None:
+            node = self.root
+        if self.parent[node] == -1:
+            self.grad_f[node] = self.grad_cn[node] = self.grad_cf[node] = 1
+            grad_f, grad_cn, grad_cf = 1, 1, 1
+
+        frontier = np.array([node])
+        mult_f = np.array([grad_f], dtype=float)
+        mult_cn = np.array([grad_cn], dtype=float)
+        mult_cf = np.array([grad_cf], dtype=float)
+        while len(frontier) > 0:
+            is_br = self.op[frontier] != OP_LEAF
+            frontier = frontier[is_br]
+            mult_f, mult_cn, mult_cf = mult_f[is_br], mult_cn[is_br], mult_cf[is_br]
+            if len(frontier) == 0:
+                break
+
+            lc, rc = self.left[frontier], self.right[frontier]
+            g = np.empty((6, len(frontier)))
+            for op in (OP_SWAP, OP_PURIFY):
+                mask = self.op[frontier] == op
+                if not np.any(mask):
+                    continue
+                f1, f2 = self.fid[lc[mask]], self.fid[rc[mask]]
+                if op == OP_SWAP:
+                    _, _, g1, g2 = self.gate.swap_fused(f1, f2)
+                else:
+                    c1, c2 = self.cost[lc[mask]], self.cost[rc[mask]]
+                    _, _, g1, g2 = self.gate.purify_fused(f1, f2, c1, c2)
+                for k in range(3):
+                    g[k, mask] = g1[k]
+                    g[3+k, mask] = g2[k]
+
+            self.grad_f[lc], self.grad_cn[lc], self.grad_cf[lc] = \
+                g[0]*mult_f, g[1]*mult_cn, g[2]*mult_cf
+            self.grad_f[rc], self.grad_cn[rc], self.grad_cf[rc] = \
+                g[3]*mult_f, g[4]*mult_cn, g[5]*mult_cf
+
+            frontier = np.concatenate([lc, rc])
+            mult_f = self.grad_f[frontier]
+            mult_cn = self.grad_cn[frontier]
+            mult_cf = self.grad_cf[frontier]
+
+    def backward(self, node: int) -> None:
+        """
+        update fidelity of all ancestors (not including itself)
+        backtrace from node to root
+        """
+        assert self.op[node] != OP_LEAF, 'Must backtrace from a Branch'
+
+        node = self.parent[node]
+        while node != -1:
+            lc, rc = self.left[node], self.right[node]
+            if self.op[node] == OP_SWAP:
+                f, p = self.gate.swap(self.fid[lc], self.fid[rc])
+            else:
+                f, p = self.gate.purify(self.fid[lc], self.fid[rc])
+            self.fid[node], self.prob[node] = f, p
+            self.cost[node] = (self.cost[lc] + self.cost[rc]) / p
+
+            node = self.parent[node]
+
+    def virtual_purify(self, node: int) -> 'tuple[qu.Fidelity, qu.ExpCost]':
+        """
+        backtrace the impact of an purification to the root
+        return the fidelity and cost of the root
+        """
+        f, p, c = self.gate.ladder.get(self.fid[node])
+        c = c * self.cost[node]
+        while self.parent[node] != -1:
+            parent = self.parent[node]
+            if node == self.left[parent]:
+                sib = self.right[parent]
+                fl, fr, cl, cr = f, self.fid[sib], c, self.cost[sib]
+            else:
+                sib = self.left[parent]
+                fl, fr, cl, cr = self.fid[sib], f, self.cost[sib], c
+            node = parent
+
+            if self.op[node] == OP_SWAP:
+                f, p = self.gate.swap(fl, fr)
+            else:
+                f, p = self.gate.purify(fl, fr)
+            c = (cl + cr) / p
+
+        return f, c
+
+    def purify(self, node: int) -> int:
+        """
+        purify a node in the tree
+        return the new node (parent of the given node and node's copy)
+        """
+        sub = self.subtree(node)
+        new = self._new(len(sub) + 1)
+        copy, branch = new[:-1], new[-1]
+
+        # map indices inside the subtree to their copies
+        order = np.argsort(sub)
+        sorted_sub = sub[order]
+        def remap(idx: np.ndarray) -> np.ndarray:
+            out = np.full(len(idx), -1, dtype=np.int64)
+            valid = idx != -1
+            out[valid] = copy[order[np.searchsorted(sorted_sub, idx[valid])]]
+            return out
+
+        for name in self.FLOAT_FIELDS:
+            arr = getattr(self, name)
+            arr[copy] = arr[sub]
+        self.op[copy] = self.op[sub]
+        self.edge[copy] = self.edge[sub]
+        self.left[copy] = remap(self.left[sub])
+        self.right[copy] = remap(self.right[sub])
+        self.parent[copy[1:]] = remap(self.parent[sub[1:]])
+
+        parent = self.parent[node]
+        self.op[branch] = OP_PURIFY
+        self.edge[branch] = self.edge[node]
+        self.left[branch], self.right[branch] = copy[0], node
+        self.parent[copy[0]] = self.parent[node] = branch
+        self.parent[branch] = parent
+        f, p = self.gate.purify(self.fid[copy[0]], self.fid[node])
+        self.fid[branch], self.prob[branch] = f, p
+        self.cost[branch] = (self.cost[copy[0]] + self.cost[node]) / p
+
+        if parent != -1:
+            if self.left[parent] == node:
+                self.left[parent] = branch
+            else:
+                self.right[parent] = branch
+        else:
+            self.root = int(branch)
+
+        return int(branch)
+
+    def calc_efficiency(self, node: int=None) -> None:
+        """
+        Calculate the efficiency of all descendants, wrt the given node
+        """
+        nodes = self.subtree(node)
+        fid, cost = self.fid[nodes], self.cost[nodes]
+        grad_f = self.grad_f[nodes]
+
+        self.efficiency[nodes] = grad_f / cost
+        pf, _ = self.gate.purify_batch(fid, fid)
+        df = (pf - fid) * grad_f
+        dc = (pf - fid) * self.grad_cf[nodes] + cost * self.grad_cn[nodes]
+        self.adjust_eff[nodes] = df / dc
+
+    def find_max(self, node: int=None, attr: str='adjust_eff',
+            ops: 'list[int]'=None) -> int:
+        """
+        find the node with max attr in the subtree
+        ops: op codes to search, all nodes if None
+        ties go to the first node in pre-order, as in MetaTree.find_max
+        """
+        nodes = self.subtree(node)
+        if ops is not None:
+            nodes = nodes[np.isin(self.op[nodes], ops)]
+        if len(nodes) == 0:
+            return None
+        values = getattr(self, attr)[nodes]
+        best = nodes[values == np.max(values)]
+        if len(best) > 1:
+            ranked, rank = self.preorder_rank(node)
+            pos = np.full(self.size, np.iinfo(np.int64).max)
+            pos[ranked] = rank
+            best = best[np.argmin(pos[best])]
+        else:
+            best = best[0]
+        return int(best)
+
+    def to_tree(self, node: int=None) -> TreeNode:
+        """
+        materialize the subtree as TreeNode objects
+        """
+        if node is None:
+            node = self.root
+        # post-order with an explicit stack, deep trees do not recurse
+        built: 'dict[int, TreeNode]' = {}
+        stack = [(int(node), False)]
+        while len(stack) > 0:
+            k, expanded = stack.pop()
+            if self.op[k] != OP_LEAF and not expanded:
+                stack.append((k, True))
+                stack.append((int(self.right[k]), False))
+                stack.append((int(self.left[k]), False))
+                continue
+            edge = tuple(self.edge[k].tolist())
+            if self.op[k] == OP_LEAF:
+                tnode = Leaf(edge, float(self.fid[k]), None)
+            else:
+                lc, rc = built.pop(int(self.left[k])), built.pop(int(self.right[k]))
+                tnode = Branch(edge, float(self.fid[k]), None,
+                    lc, rc, qu.OpType(int(self.op[k])), float(self.prob[k]))
+                lc.parent = rc.parent = tnode
+            for name in self.FLOAT_FIELDS[2:]:
+                setattr(tnode, name, float(getattr(self, name)[k]))
+            built[k] = tnode
+        return built[int(node)]
+
+    @staticmethod
+    def from_tree(root: TreeNode, gate: 'qu.Gate'=qu.GDP) -> 'ArraySPST':
+        """
+        convert a TreeNode tree, leaves keep their left-to-right order
+        """
+        order: 'list[TreeNode]' = []
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            order.append(node)
+            if not node.is_leaf():
+                stack.append(node.right)
+                stack.append(node.left)
+        leaves = [node for node in order if node.is_leaf()]
+
+        tree = ArraySPST({}, gate, capacity=len(order))
+        tree.edges = [node.edge_tuple for node in leaves]
+        tree.fids = [node.fid for node in leaves]
+        tree.leaves = dict(zip(tree.edges, tree.fids))
+        idx = tree._new(len(order))
+        index = {id(node): i for i, node in zip(idx, order)}
+        for i, node in zip(idx, order):
+            tree.edge[i] = node.edge_tuple
+            tree.fid[i] = node.fid
+            for name in ArraySPST.FLOAT_FIELDS[2:]:
+                getattr(tree, name)[i] = getattr(node, name)
+            if not node.is_leaf():
+                tree.op[i] = node.op.value
+                tree.prob[i] = node.prob
+                tree.left[i] = index[id(node.left)]
+                tree.right[i] = index[id(node.right)]
+                tree.parent[tree.left[i]] = tree.parent[tree.right[i]] = i
+        tree.root = 0
+        return tree
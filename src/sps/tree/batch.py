@@ -0,0 +1,132 @@
+
+
+# build swap trees of many paths at once
+# paths of the same length share one tree shape, so they are stacked
+# into a (paths, length) matrix and merged column by column
+
+
+import numpy as np
+
+from ...physical import quantum as qu
+from ..utils.types import TreeShape
+
+
+class TreeBatch:
+    """
+    Swap trees of a ragged collection of paths
+    the tree of path k is encoded by the merges of its group:
+    leaves are 0..n-1, merge t creates node n+t from (left, right),
+    the root is the last merge
+    """
+
+    def __init__(self, size: int, shape: TreeShape) -> None:
+        self.shape = shape
+        self.root_fid = np.zeros(size)
+        self.root_cost = np.zeros(size)
+        # path length -> (path indices, merges (n-1, 2))
+        self.groups: 'dict[int, tuple[np.ndarray, np.ndarray]]' = {}
+        # path index -> its length
+        self.length = np.zeros(size, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.root_fid)
+
+    def encoding(self, k: int) -> np.ndarray:
+        """
+        merges of the tree of path k
+        """
+        return self.groups[int(self.length[k])][1]
+
+
+def _merge_balanced(n: int) -> np.ndarray:
+    # merges of SPST.build_sst(TreeShape.BALANCED): pair round by round,
+    # an odd node left over goes to the end of the next round
+    merges = []
+    nodes = list(range(n))
+    new_id = n
+    while len(nodes) > 1:
+        next_nodes = []
+        for a in range(0, len(nodes) - 1, 2):
+            merges.append((nodes[a], nodes[a+1]))
+            next_nodes.append(new_id)
+            new_id += 1
+        if len(nodes) % 2 == 1:
+            next_nodes.append(nodes[-1])
+        nodes = next_nodes
+    return np.array(merges, dtype=np.int64).reshape(-1, 2)
+
+
+def _merge_linked(n: int) -> np.ndarray:
+    # merges of SPST.build_sst(TreeShape.LINKED): left to right
+    left = np.concatenate([[0], np.arange(n, 2*n - 2)])[:n-1].astype(np.int64)
+    right = np.arange(1, n, dtype=np.int64)
+    return np.stack([left, right], axis=1)
+
+
+def _run_merges(fids: np.ndarray, costs: np.ndarray, merges: np.ndarray,
+        gate: 'qu.Gate') -> 'tuple[np.ndarray, np.ndarray]':
+    """
+    evaluate the merges on all rows of fids & costs (m, n)
+    merges without dependencies among them run as one batch op
+    return root (fid, cost) of each row
+    """
+    m, n = fids.shape
+    F = np.empty((m, 2*n - 1))
+    C = np.empty((m, 2*n - 1))
+    F[:, :n], C[:, :n] = fids, costs
+    if len(merges) == 0:
+        return F[:, 0], C[:, 0]
+
+    # a merge runs after both its children
+    height = np.zeros(2*n - 1, dtype=np.int64)
+    for t, (a, b) in enumerate(merges.tolist()):
+        height[n + t] = 1 + max(height[a], height[b])
+    for h in range(1, height.max() + 1):
+        ts = np.nonzero(height[n:] == h)[0]
+        a, b = merges[ts, 0], merges[ts, 1]
+        f, p = gate.swap_batch(F[:, a], F[:, b])
+        F[:, n + ts] = f
+        C[:, n + ts] = (C[:, a] + C[:, b]) / p
+    return F[:, -1], C[:, -1]
+
+
+def build_batch(fids: 'list[list[qu.Fidelity]]', gate: 'qu.Gate'=qu.GDP,
+        shape: TreeShape=TreeShape.BALANCED, costs: 'list[list[qu.ExpCost]]'=None) -> TreeBatch:
+    """
+    build the swap tree of every path (a vector of leaf fids)
+    costs: leaf costs of every path, 1 by default
+    """
+    if shape == TreeShape.BALANCED:
+        merge_fn = _merge_balanced
+    elif shape == TreeShape.LINKED:
+        merge_fn = _merge_linked
+    else:
+        raise NotImplementedError('shape not implemented')
+
+    batch = TreeBatch(len(fids), shape)
+    batch.length[:] = [len(f) for f in fids]
+    for n in np.unique(batch.length).tolist():
+        assert n > 0, 'empty path'
+        rows = np.nonzero(batch.length == n)[0]
+        F = np.array([fids[k] for k in rows], dtype=float).reshape(-1, n)
+        if costs is None:
+            C = np.ones_like(F)
+        else:
+            C = np.array([costs[k] for k in rows], dtype=float).reshape(-1, n)
+        merges = merge_fn(n)
+        batch.root_fid[rows], batch.root_cost[rows] = _run_merges(F, C, merges, gate)
+        batch.groups[n] = (rows, merges)
+
+    return batch
+
+
+def task_fids(task) -> 'tuple[list[tuple], list[list[qu.Fidelity]]]':
+    """
+    (user pair, path index) keys & leaf fids of all paths of a QuNetTask
+    """
+    keys, fids = [], []
+    for user_pair, paths in task.up_paths.items():
+        for k, path in enumerate(paths):
+            keys.append((user_pair, k))
+            fids.append([task.net.edges[edge]['obj'].fid for edge in path])
+    return keys, fids
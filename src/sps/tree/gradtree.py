@@ -1,12 +1,17 @@
 
 
 from copy import deepcopy
+from contextlib import contextmanager
+import time
 
 
+from ...physical import StaticQuPath
 from ...physical.network import EdgeTuple
 from ...physical import quantum as qu
+from ..base import PathSolver, Deadline, AnytimeResult
 from ..utils.tree import TreeNode, Leaf, Branch, MetaTree
-from ..utils.types import TreeShape
+from ..utils.types import TreeShape, ExpAlloc
+from .interval import INTERVAL_DP
 
 class SPST(MetaTree):
     """
@@ -15,9 +20,74 @@ class SPST(MetaTree):
     both swap and purification are binary operators
     """
 
-    def __init__(self, leaves: 'dict[EdgeTuple, qu.FidType]', gate: 'qu.Gate'=qu.GDP) -> None:
+    def __init__(self, leaves: 'dict[EdgeTuple, qu.FidType]', gate: 'qu.Gate'=qu.GDP,
+            lazy: bool=False) -> None:
+        # lazy: backward() only marks ancestors dirty,
+        # they are recomputed once by commit() or when the root is read
+        self.lazy = lazy
+        self._pending = False
+        self._root: TreeNode = None
         super().__init__(leaves, gate)
 
+        # (iteration, seconds, root fid, root cost) of each optimize() step
+        self.history: 'list[tuple[int, float, qu.Fidelity, qu.ExpCost]]' = []
+        # the last optimize() was stopped by its deadline
+        self.preempted = False
+
+    @property
+    def root(self) -> TreeNode:
+        if self._pending:
+            self.commit()
+        return self._root
+
+    @root.setter
+    def root(self, node: TreeNode) -> None:
+        self._root = node
+
+    @contextmanager
+    def batch(self):
+        """
+        edits inside the block are recomputed together when it exits
+        """
+        lazy = self.lazy
+        self.lazy = True
+        try:
+            yield self
+        finally:
+            self.lazy = lazy
+            self.commit()
+
+    def _update(self, node: Branch) -> None:
+        # recompute fid, prob & cost of a branch from its children
+        if node.op == qu.OpType.SWAP:
+            node.fid, node.prob = self.gate.swap(node.left.fid, node.right.fid)
+        elif node.op == qu.OpType.PURIFY:
+            node.fid, node.prob = self.gate.purify(node.left.fid, node.right.fid)
+        node.cost = (node.left.cost + node.right.cost) / node.prob
+        self._reindex(node)
+
+    def _mark_dirty(self, node: TreeNode) -> None:
+        # a dirty node always has dirty ancestors, so stop at the first one
+        while node is not None and not node.dirty:
+            node.dirty = True
+            node = node.parent
+        self._pending = True
+
+    def commit(self) -> None:
+        """
+        recompute every dirty node exactly once, bottom-up
+        """
+        def flush(node: TreeNode) -> None:
+            if node is None or not node.dirty:
+                return
+            flush(node.left)
+            flush(node.right)
+            self._update(node)
+            node.dirty = False
+
+        self._pending = False
+        flush(self._root)
+
     def build_sst(self, shape=TreeShape.BALANCED, costs: 'list[qu.ExpCostType]'=None) -> TreeNode:
         """
         Build the SST with initial leaves
@@ -54,8 +124,8 @@ class SPST(MetaTree):
         def _build_linked(leaves: 'list[TreeNode]') -> TreeNode:
             while len(leaves) > 1:
                 node1, node2 = leaves.pop(0), leaves.pop(0)
-                f, p = self.gate.purify(node1.fid, node2.fid)
-                edge = deepcopy(node1.edge_tuple)
+                f, p = self.gate.swap(node1.fid, node2.fid)
+                edge = (node1.edge_tuple[0], node2.edge_tuple[1])
                 new_node = Branch(edge, f, None, node1, node2, qu.OpType.SWAP, p)
                 new_node.cost = (node1.cost + node2.cost) / p
                 node1.parent = new_node
@@ -65,28 +135,50 @@ class SPST(MetaTree):
             return leaves[0]
 
         def _build_optimal(leaves: 'list[TreeNode]',) -> TreeNode:
+            # merge two adjacent nodes with minimal cost, one pair at a time
             nodes = leaves
-            # merge two adjacent nodes round by round
-            while len(nodes) > 1:
-                # find two adjacent nodes with minimal cost
-                min_cost = float('inf')
-                min_node_idx = None
-                for i in range(len(nodes)-1):
-                    cost = nodes[i].cost + nodes[i+1].cost
-                    if cost < min_cost:
-                        min_cost = cost
-                        min_node_idx = i
-                # merge the two nodes
-                node1, node2 = nodes.pop(min_node_idx), nodes.pop(min_node_idx)
+            merges = self.greedy_merges([leaf.cost for leaf in leaves], self.gate.hw.prob_swap)
+            for i, j in merges:
+                node1, node2 = nodes[i], nodes[j]
                 f, p = self.gate.swap(node1.fid, node2.fid)
-                edge = deepcopy(node1.edge_tuple)
+                edge = (node1.edge_tuple[0], node2.edge_tuple[1])
                 new_node = Branch(edge, f, None, node1, node2, qu.OpType.SWAP, p)
                 new_node.cost = (node1.cost + node2.cost) / p
                 node1.parent = new_node
                 node2.parent = new_node
-                nodes.insert(min_node_idx, new_node)
+                nodes.append(new_node)
 
-            return nodes[0]
+            return nodes[-1]
+
+        def _build_dp(leaves: 'list[TreeNode]') -> TreeNode:
+            # exact min cost tree from the interval DP splits
+            _, K = INTERVAL_DP.solve([leaf.cost for leaf in leaves], self.gate.hw.prob_swap)
+            built: 'dict[tuple[int, int], TreeNode]' = {}
+            stack = [(0, len(leaves) - 1, False)]
+            while len(stack) > 0:
+                i, j, expanded = stack.pop()
+                if i == j:
+                    built[(i, j)] = leaves[i]
+                    continue
+                k = int(K[i, j])
+                if not expanded:
+                    stack.append((i, j, True))
+                    stack.append((k + 1, j, False))
+                    stack.append((i, k, False))
+                    continue
+                node1, node2 = built.pop((i, k)), built.pop((k + 1, j))
+                f, p = self.gate.swap(node1.fid, node2.fid)
+                edge = (node1.edge_tuple[0], node2.edge_tuple[1])
+                new_node = Branch(edge, f, None, node1, node2, qu.OpType.SWAP, p)
+                new_node.cost = (node1.cost + node2.cost) / p
+                node1.parent = new_node
+                node2.parent = new_node
+                built[(i, j)] = new_node
+
+            return built[(0, len(leaves) - 1)]
+
+        # the nodes of the old tree leave the heap with it
+        self.untrack()
 
         # sort the edges by fidelity
         # edges = sorted(self.leaves.items(), key=lambda x: x[1], reverse=True)
@@ -102,6 +194,8 @@ class SPST(MetaTree):
             self.root = _build_linked(leaves)
         elif shape == TreeShape.ST_OPT:
             self.root = _build_optimal(leaves)
+        elif shape == TreeShape.ST_DP:
+            self.root = _build_dp(leaves)
         else:
             raise NotImplementedError('shape not implemented')
 
@@ -112,29 +206,19 @@ class SPST(MetaTree):
         """
         Calculate the grads of all descendants, wrt the given node
         self_grad is the grad of the node itself (from its parent)
+        the grads of the root itself are 1
         """
-        def grad_root():
-            # f, c = node.fid, node.cost
-            # gf, gcn, gcf = self.gate.purify_grad(f, f, c, c, 1)
-            
-            node.grad_f, node.grad_cn, node.grad_cf = 1, 1, 1
-            self.grad(node.left, 1, 1, 1)
-            self.grad(node.right, 1, 1, 1)
-        
         def grad_branch():
             # calculate the grads of children
             f1, f2 = node.left.fid, node.right.fid
             c1, c2 = node.left.cost, node.right.cost
+            # both partials come from a single fused evaluation
             if node.op == qu.OpType.SWAP:
-                gf1, gcn1, gcf1 = self.gate.swap_grad(f1, f2, 1)
-                gf1, gcn1, gcf1 = gf1*grad_f, gcn1*grad_cn, gcf1*grad_cf        
-                gf2, gcn2, gcf2 = self.gate.swap_grad(f1, f2, 2)
-                gf2, gcn2, gcf2 = gf2*grad_f, gcn2*grad_cn, gcf2*grad_cf
+                _, _, g1, g2 = self.gate.swap_fused(f1, f2)
             elif node.op == qu.OpType.PURIFY:
-                gf1, gcn1, gcf1 = self.gate.purify_grad(f1, f2, c1, c2, 1) 
-                gf1, gcn1, gcf1 = gf1*grad_f, gcn1*grad_cn, gcf1*grad_cf
-                gf2, gcn2, gcf2 = self.gate.purify_grad(f1, f2, c1, c2, 2) 
-                gf2, gcn2, gcf2 = gf2*grad_f, gcn1*grad_cn, gcf1*grad_cf
+                _, _, g1, g2 = self.gate.purify_fused(f1, f2, c1, c2)
+            gf1, gcn1, gcf1 = g1[0]*grad_f, g1[1]*grad_cn, g1[2]*grad_cf
+            gf2, gcn2, gcf2 = g2[0]*grad_f, g2[1]*grad_cn, g2[2]*grad_cf
             
             # update the grads of children
             node.left.grad_f = gf1
@@ -143,35 +227,72 @@ class SPST(MetaTree):
             node.right.grad_f = gf2
             node.right.grad_cn = gcn2
             node.right.grad_cf = gcf2
+            self._reindex(node.left)
+            self._reindex(node.right)
             # recursively update the grads of descendants
             self.grad(node.left, gf1, gcn1, gcf1)
             self.grad(node.right, gf2, gcn2, gcf2)
 
+        if self._pending:
+            self.commit()
         if node is None or node.is_leaf():
             return
         
         if node.is_root():
-            grad_root()
+            node.grad_f, node.grad_cn, node.grad_cf = 1, 1, 1
+            grad_f, grad_cn, grad_cf = 1, 1, 1
+            self._reindex(node)
+        grad_branch()
+
+    def _child_grads(self, node: Branch) -> 'tuple[tuple, tuple]':
+        # grads of the children of node from its own grads
+        f1, f2 = node.left.fid, node.right.fid
+        if node.op == qu.OpType.SWAP:
+            _, _, g1, g2 = self.gate.swap_fused(f1, f2)
         else:
-            grad_branch()
+            _, _, g1, g2 = self.gate.purify_fused(f1, f2, node.left.cost, node.right.cost)
+        own = node.grad_f, node.grad_cn, node.grad_cf
+        return tuple(g*o for g, o in zip(g1, own)), tuple(g*o for g, o in zip(g2, own))
+
+    def regrad_path(self, node: TreeNode) -> None:
+        """
+        refresh the grads & efficiency of the ancestors of node
+        and of their other children, root first
+        the subtrees hanging off the path keep their (stale) grads
+        """
+        if self._pending:
+            self.commit()
+        path = []
+        while node.parent is not None:
+            path.append(node.parent)
+            node = node.parent
+        root = node
+        root.grad_f, root.grad_cn, root.grad_cf = 1, 1, 1
+        for anc in reversed(path):
+            for child, grads in zip((anc.left, anc.right), self._child_grads(anc)):
+                child.grad_f, child.grad_cn, child.grad_cf = grads
+        for anc in reversed(path):
+            self._efficiency(anc)
+            self._efficiency(anc.left)
+            self._efficiency(anc.right)
 
     def backward(self, node: Branch) -> None:
         """
         update fidelity of all ancestors (not including itself)
         backtrace from node to root
+        in lazy mode the ancestors are only marked dirty
         """
         
         # cannot and shouldn't update fidelity of a leaf node
         assert isinstance(node, Branch), 'Must backtrace from a Branch'
 
+        if self.lazy:
+            self._mark_dirty(node.parent)
+            return
+
         node = node.parent
         while node is not None:
-            if node.op == qu.OpType.SWAP:
-                node.fid, node.prob = self.gate.swap(node.left.fid, node.right.fid)
-            elif node.op == qu.OpType.PURIFY:
-                node.fid, node.prob = self.gate.purify(node.left.fid, node.right.fid)
-            node.cost = (node.left.cost + node.right.cost) / node.prob
-            
+            self._update(node)
             node = node.parent
 
     def virtual_purify(self, node: TreeNode) -> 'tuple[qu.Fidelity, qu.ExpCost]':
@@ -179,11 +300,13 @@ class SPST(MetaTree):
         backtrace the impact of an purification to the root
         return the fidelity and cost of the root
         """
+        if self._pending:
+            self.commit()
         
         # get f, c after the purification
         old_f, old_c = node.fid, node.cost
-        f, p = self.gate.purify(old_f, old_f)
-        c = (old_c + old_c) / p
+        f, p, c = self.gate.ladder.get(old_f)
+        c = c * old_c
         while node.parent is not None:
             # process node.parent at each iteration
             if node == node.parent.left:
@@ -227,15 +350,22 @@ class SPST(MetaTree):
         else:
             self.root = new_node
 
-        return new_node
+        if self.lazy:
+            # node may be stale, recompute the new branch at commit
+            self._mark_dirty(new_node)
+        if self.heap is not None:
+            # index the copied subtree and the new branch
+            stack = [new_node.left]
+            while len(stack) > 0:
+                n = stack.pop()
+                if n is not None:
+                    self._reindex(n)
+                    stack.extend((n.left, n.right))
+            self._reindex(new_node)
 
-    def calc_efficiency(self, node: TreeNode):
-        """
-        Calculate the efficiency of all descendants, wrt the given node
-        """
-        if node is None:
-            return
+        return new_node
 
+    def _efficiency(self, node: TreeNode) -> None:
         # calculate the efficiency
         node.efficiency = node.grad_f / node.cost
         # calculate adjusted efficiency
@@ -244,13 +374,145 @@ class SPST(MetaTree):
         # df = rf - self.root.fid
         # dc = rc - self.root.cost
         # grad method
-        pf, p = self.gate.purify(node.fid, node.fid)
+        pf, p, _ = self.gate.ladder.get(node.fid)
         df = (pf - node.fid)*node.grad_f
         dc = (pf - node.fid)*node.grad_cf + node.cost*node.grad_cn
         node.adjust_eff = df / dc
+        self._reindex(node)
+
+    def calc_efficiency(self, node: TreeNode):
+        """
+        Calculate the efficiency of all descendants, wrt the given node
+        """
+        if self._pending:
+            self.commit()
+        if node is None:
+            return
+
+        self._efficiency(node)
 
         # recursive on descendants
         self.calc_efficiency(node.left)
         self.calc_efficiency(node.right)
 
+    def optimize(self, target_fid: qu.Fidelity, budget: qu.ExpCost=float('inf'),
+            attr: str="adjust_eff", search_range=[TreeNode],
+            regrad_every: int=1, max_iters: int=10**5,
+            deadline: Deadline=None) -> 'tuple[TreeNode, ExpAlloc]':
+        """
+        Greedy purification: purify the node with max attr
+        until the root reaches target_fid
+        stop early if the best purification exceeds the cost budget
+        or cannot raise the root fidelity any more
+        regrad_every: full grad & efficiency sweep every n iterations,
+            1 (the default) is the exact greedy; n > 1 refreshes only the
+            purified subtree and the path to the root in between, which
+            leaves the grads below the changed ancestors stale and can pick
+            worse nodes (up to 2x the cost on dephased links at target 0.9);
+            None to never sweep again
+            a stale choice that fails is retried after a full sweep
+        deadline: stop once it expires, the tree is left consistent
+        return the root and the expected cost of each edge
+        """
+        if self.root is None:
+            self.build_sst()
+        if self.heap is None or self.heap.attr != attr \
+                or self.heap.search_range != tuple(search_range):
+            self.track(attr, search_range)
+
+        self.history = []
+        self.preempted = False
+        start = time.perf_counter()
+        it = 0
+        # steps since the last full sweep, None before the first one
+        stale = None
+        while self.root.fid < target_fid and it < max_iters:
+            if deadline is not None and deadline.expired():
+                self.preempted = True
+                break
+            if stale is None or (regrad_every is not None and stale >= regrad_every):
+                self.grad(self.root)
+                self.calc_efficiency(self.root)
+                stale = 0
+
+            node = self.max_node(attr, search_range)
+            if node is None:
+                break
+            f, c = self.virtual_purify(node)
+            if c > budget or f <= self.root.fid:
+                if stale > 0:
+                    # the choice may come from stale grads, retry on fresh ones
+                    stale = None
+                    continue
+                break
+
+            new_node = self.purify(node)
+            self.backward(new_node)
+            stale += 1
+            if regrad_every != 1:
+                # the new branch takes the place of node,
+                # its grads & those around the path to the root change
+                self.regrad_path(new_node)
+                self.grad(new_node, new_node.grad_f, new_node.grad_cn, new_node.grad_cf)
+                self.calc_efficiency(new_node)
+
+            it += 1
+            if deadline is not None:
+                deadline.tick()
+            self.history.append((it, time.perf_counter() - start, self.root.fid, self.root.cost))
+
+        return self.root, self.exp_alloc()
+
+
+class GreedySolver(PathSolver):
+    """
+    Build a swap tree, then purify greedily with SPST.optimize
+    """
+
+    def __init__(self, edges: StaticQuPath, gate: qu.Gate,
+            target_fid: qu.Fidelity, budget: qu.ExpCost=float('inf'),
+            shape: TreeShape=TreeShape.BALANCED) -> None:
+        super().__init__(edges, gate)
+        self.target_fid = target_fid
+        self.budget = budget
+        self.shape = shape
+
+        self.tree: SPST = None
+
+    def solve(self) -> ExpAlloc:
+        self.tree = SPST(dict(self.edges), self.gate)
+        self.tree.build_sst(self.shape)
+        _, alloc = self.tree.optimize(self.target_fid, self.budget)
+        return alloc
+
+    def solve_anytime(self, deadline: Deadline) -> AnytimeResult:
+        """
+        purify until the target, the budget or the deadline is reached
+        """
+        deadline.start()
+        self.tree = SPST(dict(self.edges), self.gate)
+        self.tree.build_sst(self.shape)
+        root, alloc = self.tree.optimize(self.target_fid, self.budget, deadline=deadline)
+        return AnytimeResult(alloc, root, self.target_fid, not self.tree.preempted, deadline)
+
+
+def test_optimize():
+    # the default optimize is the exact greedy: it purifies the same nodes
+    # as regrad_every=1 on dephased & werner links
+    import numpy as np
+    rng = np.random.default_rng(0)
+    for gate, target in ((qu.GDP, 0.9), (qu.GWP, 0.8)):
+        for n in (8, 16, 32):
+            leaves = dict(((i, i + 1), f) for i, f in enumerate(rng.uniform(0.9, 0.99, n).tolist()))
+            default, exact = SPST(dict(leaves), gate), SPST(dict(leaves), gate)
+            default.build_sst()
+            exact.build_sst()
+            default.optimize(target, max_iters=500)
+            exact.optimize(target, regrad_every=1, max_iters=500)
+            assert [h[2:] for h in default.history] == [h[2:] for h in exact.history], \
+                f'{gate.ent_type.name} {n} hops: the default differs from the exact greedy'
+
+
+if __name__ == '__main__':
 
+    test_optimize()
@@ -0,0 +1,190 @@
+
+
+# exact optimal swap tree over a path by interval dynamic programming
+# the fidelity of a swap tree does not depend on its shape (see Gate.chain_swap),
+# so the optimal shape only minimizes the root expected cost:
+#   C[i, i] = c_i
+#   C[i, j] = min_{i <= k < j} (C[i, k] + C[k+1, j]) / p_swap
+# C[i, j] & K[i, j] only depend on the costs of i..j, so a segment shared
+# with an already solved path is copied from its tables instead of solved
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def use_knuth(costs: 'list[float]', prob: float) -> bool:
+    return bool(np.all(np.asarray(costs, dtype=float) >= 0)) and 0 < prob <= 1
+
+
+def interval_dp(costs: 'list[float]', prob: float, knuth: bool=None,
+        seed: tuple=None) -> 'tuple[np.ndarray, np.ndarray]':
+    """
+    return (C, K): C[i, j] is the min cost of segments i..j,
+    K[i, j] the split, i.e. the left subtree covers i..K[i, j]
+    knuth: restrict K[i, j] to [K[i, j-1], K[i+1, j]]
+        C satisfies the quadrangle inequality when costs >= 0 and prob <= 1,
+        so the pruning is exact then; None to decide from the inputs
+    seed: (a, C_ab, K_ab), the tables of the segment a..a+len(C_ab)-1,
+        solved with the same prob & knuth, K_ab relative to a
+        its intervals are copied instead of solved
+    """
+    costs = np.asarray(costs, dtype=float)
+    n = len(costs)
+    if knuth is None:
+        knuth = use_knuth(costs, prob)
+
+    C = np.full((n, n), np.inf)
+    K = np.zeros((n, n), dtype=np.int64)
+    idx = np.arange(n)
+    C[idx, idx] = costs
+    K[idx, idx] = idx
+    a, b = 0, -1
+    if seed is not None:
+        a, C_ab, K_ab = seed
+        b = a + len(C_ab) - 1
+        C[a:b+1, a:b+1] = C_ab
+        K[a:b+1, a:b+1] = np.triu(K_ab + a)
+
+    for length in range(2, n + 1):
+        i = np.arange(n - length + 1)
+        j = i + length - 1
+        if b >= a + length - 1:
+            # intervals inside the seed are known
+            keep = (i < a) | (j > b)
+            i, j = i[keep], j[keep]
+            if len(i) == 0:
+                continue
+        if knuth and length > 2:
+            lo, hi = K[i, j-1], K[i+1, j]
+        else:
+            lo, hi = i, j - 1
+        width = int(np.max(hi - lo)) + 1
+        # candidate splits, one column per interval
+        ks = lo[None, :] + np.arange(width)[:, None]
+        valid = ks <= hi[None, :]
+        ks = np.where(valid, ks, lo[None, :])
+        cand = C[i[None, :], ks] + C[ks + 1, j[None, :]]
+        cand[~valid] = np.inf
+
+        best = np.argmin(cand, axis=0)
+        cols = np.arange(len(i))
+        C[i, j] = cand[best, cols] / prob
+        K[i, j] = ks[best, cols]
+
+    return C, K
+
+
+class IntervalDP:
+    """
+    interval_dp() with a LRU memo of DP tables, keyed by (prob, leaf costs)
+    paths with equal leaf costs share one table: the tables of a shorter
+    path are its top-left block, scaled by the leaf cost
+    other paths reuse a run of at least window leaf costs they share with
+    a memoized path (the longest found), as a block of its tables:
+    the windows of window costs of every memoized path are indexed
+    """
+
+    def __init__(self, maxsize: int=128, window: int=8) -> None:
+        self.maxsize = maxsize
+        self.window = window
+        self._memo: 'OrderedDict[tuple, tuple[np.ndarray, np.ndarray]]' = OrderedDict()
+        # costs of a window -> (key, start) of its first memoized occurrence
+        self._windows: 'dict[tuple, tuple[tuple, int]]' = {}
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+
+    def _get(self, key: tuple):
+        tables = self._memo.get(key)
+        if tables is not None:
+            self._memo.move_to_end(key)
+        return tables
+
+    def _put(self, key: tuple, tables: 'tuple[np.ndarray, np.ndarray]') -> None:
+        self._memo[key] = tables
+        self._memo.move_to_end(key)
+        if key[1] != 'uniform':
+            self._index(key, 1)
+        while len(self._memo) > self.maxsize:
+            old, _ = self._memo.popitem(last=False)
+            if old[1] != 'uniform':
+                self._index(old, -1)
+
+    def _index(self, key: tuple, sign: int) -> None:
+        # add (sign 1) or drop (sign -1) the windows of a memoized path
+        costs, w = key[1], self.window
+        for t in range(len(costs) - w + 1):
+            window = (key[0], key[2]) + costs[t:t + w]
+            if sign > 0:
+                self._windows.setdefault(window, (key, t))
+            elif self._windows.get(window, (None,))[0] == key:
+                del self._windows[window]
+
+    def _shared(self, costs: tuple, prob: float, knuth: bool) -> tuple:
+        """
+        (a, key, t, m): a run costs[a:a+m] == key costs[t:t+m] of a memoized
+        path, the longest found, None if there is none of window leaves
+        """
+        best, w = None, self.window
+        a = 0
+        while a + w <= len(costs):
+            found = self._windows.get((prob, knuth) + costs[a:a + w])
+            if found is None:
+                a += 1
+                continue
+            key, t = found
+            other = key[1]
+            m = w
+            while a + m < len(costs) and t + m < len(other) and costs[a + m] == other[t + m]:
+                m += 1
+            if best is None or m > best[3]:
+                best = (a, key, t, m)
+            a += m - w + 1
+        return best
+
+    def solve(self, costs: 'list[float]', prob: float) -> 'tuple[np.ndarray, np.ndarray]':
+        """
+        (C, K) tables of interval_dp(costs, prob)
+        """
+        costs = tuple(float(c) for c in costs)
+        n = len(costs)
+        uniform = n > 0 and costs[0] > 0 and all(c == costs[0] for c in costs)
+
+        if uniform:
+            # solved once with unit costs for the longest path seen
+            key = (prob, 'uniform')
+            tables = self._get(key)
+            if tables is None or len(tables[0]) < n:
+                self.misses += 1
+                tables = interval_dp([1.0] * n, prob)
+                self._put(key, tables)
+            else:
+                self.hits += 1
+            C, K = tables
+            return C[:n, :n] * costs[0], K[:n, :n]
+
+        knuth = use_knuth(costs, prob)
+        key = (prob, costs, knuth)
+        tables = self._get(key)
+        if tables is not None:
+            self.hits += 1
+            return tables
+
+        seed = None
+        shared = self._shared(costs, prob, knuth) if n > self.window else None
+        if shared is not None:
+            a, other, t, m = shared
+            C, K = self._get(other)
+            seed = (a, C[t:t+m, t:t+m], K[t:t+m, t:t+m] - t)
+            self.partial_hits += 1
+        else:
+            self.misses += 1
+        tables = interval_dp(costs, prob, knuth, seed)
+        self._put(key, tables)
+        return tables
+
+
+# shared by all trees
+INTERVAL_DP = IntervalDP()
@@ -0,0 +1,334 @@
+
+
+from ...physical.network import EdgeTuple
+from ...physical import quantum as qu
+from ..utils.tree import TreeNode, Leaf, Branch
+from ..utils.types import TreeShape
+from .gradtree import SPST
+
+
+class SharedNode:
+    """
+    Immutable node of a hash-consed SPST
+    the same subtree may be referenced by many parents,
+    e.g. both children of a PURIFY branch are one SharedNode
+    """
+    __slots__ = ('op', 'left', 'right', 'edge_tuple', 'fid', 'prob', 'cost')
+
+    def __init__(self, op: qu.OpType, left: 'SharedNode', right: 'SharedNode',
+            edge_tuple: EdgeTuple, fid: qu.Fidelity, prob: float, cost: qu.ExpCost) -> None:
+        self.op = op
+        self.left = left
+        self.right = right
+        self.edge_tuple = edge_tuple
+        self.fid = fid
+        self.prob = prob
+        self.cost = cost
+
+    def is_leaf(self) -> bool:
+        return self.left is None and self.right is None
+
+    def is_shared(self) -> bool:
+        # both children are the same subtree
+        return self.left is not None and self.left is self.right
+
+    def __str__(self) -> str:
+        if self.is_leaf():
+            return "L"
+        return self.op.name[0] + ('*' if self.is_shared() else '')
+
+
+class SharedSPST:
+    """
+    SPST as a hash-consed DAG
+    equal subtrees are stored once, so purifying a subtree
+    references it twice instead of copying it
+    an instance of a node is the path from the root to it: 0 left, 1 right;
+    under a shared PURIFY branch both copies are one instance, reached by 0
+    per-instance data (grads, efficiencies) is kept in lists by the pre-order
+    index of the instance, which only stores its parent index & step,
+    path_of(k) rebuilds the path of one instance
+    """
+
+    def __init__(self, leaves: 'dict[EdgeTuple, float]', gate: 'qu.Gate'=qu.GDP) -> None:
+        self.leaves = leaves
+        self.gate = gate
+
+        self.edges = list(self.leaves.keys())
+        self.fids = list(self.leaves.values())
+
+        self.root: SharedNode = None
+        # (op, id(left), id(right)) or (None, edge, fid, cost) -> node
+        self._table: 'dict[tuple, SharedNode]' = {}
+        # fused grads of each unique branch, computed once
+        self._local_grads: 'dict[int, tuple]' = {}
+
+        # instances of the last grad(), in pre-order
+        self._nodes: 'list[SharedNode]' = []
+        self._parents: 'list[int]' = []
+        self._steps: 'list[int]' = []
+
+        self.grads: 'list[tuple[qu.Fidelity, qu.ExpCost, qu.ExpCost]]' = []
+        self.efficiency: 'list[float]' = []
+        self.adjust_eff: 'list[float]' = []
+
+    def leaf(self, edge_tuple: EdgeTuple, fid: qu.Fidelity, cost: qu.ExpCost=1) -> SharedNode:
+        key = (None, edge_tuple, fid, cost)
+        node = self._table.get(key)
+        if node is None:
+            node = SharedNode(None, None, None, edge_tuple, fid, 1, cost)
+            self._table[key] = node
+        return node
+
+    def branch(self, op: qu.OpType, left: SharedNode, right: SharedNode) -> SharedNode:
+        """
+        the unique branch over (left, right)
+        fid, prob & cost are computed only when it is first created
+        """
+        key = (op, id(left), id(right))
+        node = self._table.get(key)
+        if node is None:
+            if op == qu.OpType.SWAP:
+                f, p = self.gate.swap(left.fid, right.fid)
+                edge = (left.edge_tuple[0], right.edge_tuple[1])
+            else:
+                f, p = self.gate.purify(left.fid, right.fid)
+                edge = right.edge_tuple
+            node = SharedNode(op, left, right, edge, f, p, (left.cost + right.cost) / p)
+            self._table[key] = node
+        return node
+
+    def from_tree(self, root: TreeNode) -> SharedNode:
+        """
+        intern a TreeNode tree, copies made by SPST.purify collapse into one
+        """
+        done: 'list[SharedNode]' = []
+        stack = [(root, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if node.is_leaf():
+                done.append(self.leaf(node.edge_tuple, node.fid, node.cost))
+            elif not expanded:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+            else:
+                right = done.pop()
+                left = done.pop()
+                done.append(self.branch(node.op, left, right))
+        return done[0]
+
+    def build_sst(self, shape=TreeShape.BALANCED, costs: 'list[qu.ExpCost]'=None) -> SharedNode:
+        tree = SPST(self.leaves, self.gate)
+        self.root = self.from_tree(tree.build_sst(shape, costs))
+        return self.root
+
+    def node_at(self, path: tuple) -> SharedNode:
+        node = self.root
+        for step in path:
+            node = node.left if step == 0 else node.right
+        return node
+
+    def instances(self) -> 'list[tuple[tuple, SharedNode]]':
+        """
+        all (path, node) instances in pre-order
+        builds every path, O(instances * depth), see _walk
+        """
+        out = []
+        stack = [((), self.root)]
+        while len(stack) > 0:
+            path, node = stack.pop()
+            out.append((path, node))
+            if node.is_leaf():
+                continue
+            if not node.is_shared():
+                stack.append((path + (1,), node.right))
+            stack.append((path + (0,), node.left))
+        return out
+
+    def _walk(self) -> 'tuple[list[SharedNode], list[int], list[int]]':
+        """
+        all instances in pre-order as (node, parent index, step from it)
+        the root has parent -1
+        """
+        nodes, parents, steps = [], [], []
+        stack = [(self.root, -1, 0)]
+        while len(stack) > 0:
+            node, parent, step = stack.pop()
+            k = len(nodes)
+            nodes.append(node)
+            parents.append(parent)
+            steps.append(step)
+            if node.is_leaf():
+                continue
+            if not node.is_shared():
+                stack.append((node.right, k, 1))
+            stack.append((node.left, k, 0))
+        return nodes, parents, steps
+
+    def path_of(self, k: int) -> tuple:
+        """
+        path of the instance with pre-order index k in the last grad()
+        """
+        path = []
+        while self._parents[k] != -1:
+            path.append(self._steps[k])
+            k = self._parents[k]
+        return tuple(reversed(path))
+
+    def unique_nodes(self) -> 'list[SharedNode]':
+        seen = {}
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen[id(node)] = node
+            if not node.is_leaf():
+                stack.append(node.left)
+                stack.append(node.right)
+        return list(seen.values())
+
+    def tree_size(self) -> int:
+        """
+        number of nodes of the equivalent (unshared) tree
+        """
+        size = {}
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack[-1]
+            if id(node) in size:
+                stack.pop()
+            elif node.is_leaf():
+                size[id(node)] = 1
+                stack.pop()
+            elif id(node.left) in size and id(node.right) in size:
+                size[id(node)] = 1 + size[id(node.left)] + size[id(node.right)]
+                stack.pop()
+            else:
+                stack.append(node.right)
+                stack.append(node.left)
+        return size[id(self.root)]
+
+    def collect(self) -> None:
+        """
+        drop interned nodes that are no longer reachable from the root
+        """
+        alive = {id(node) for node in self.unique_nodes()}
+        self._table = {key: node for key, node in self._table.items() if id(node) in alive}
+        self._local_grads = {k: v for k, v in self._local_grads.items() if k in alive}
+
+    def _local_grad(self, node: SharedNode) -> tuple:
+        g = self._local_grads.get(id(node))
+        if g is None:
+            l, r = node.left, node.right
+            if node.op == qu.OpType.SWAP:
+                _, _, g1, g2 = self.gate.swap_fused(l.fid, r.fid)
+            else:
+                _, _, g1, g2 = self.gate.purify_fused(l.fid, r.fid, l.cost, r.cost)
+            g = (g1, g2)
+            self._local_grads[id(node)] = g
+        return g
+
+    def grad(self) -> None:
+        """
+        Calculate the grads of all instances wrt the root
+        """
+        self._nodes, self._parents, self._steps = self._walk()
+        self.grads = [(1, 1, 1)] * len(self._nodes)
+        for k in range(1, len(self._nodes)):
+            parent = self._parents[k]
+            gf, gcn, gcf = self.grads[parent]
+            g = self._local_grad(self._nodes[parent])[self._steps[k]]
+            self.grads[k] = (g[0]*gf, g[1]*gcn, g[2]*gcf)
+
+    def calc_efficiency(self) -> None:
+        """
+        Calculate the efficiency of all instances, see SPST.calc_efficiency
+        """
+        self.efficiency, self.adjust_eff = [], []
+        for node, (grad_f, grad_cn, grad_cf) in zip(self._nodes, self.grads):
+            self.efficiency.append(grad_f / node.cost)
+            pf, _, _ = self.gate.ladder.get(node.fid)
+            df = (pf - node.fid)*grad_f
+            dc = (pf - node.fid)*grad_cf + node.cost*grad_cn
+            self.adjust_eff.append(df / dc)
+
+    def find_max(self, attr: str="adjust_eff") -> tuple:
+        """
+        the path of the instance with max attr, the first one in pre-order
+        """
+        values: 'list[float]' = getattr(self, attr)
+        best = None
+        for k, value in enumerate(values):
+            if best is None or value > values[best]:
+                best = k
+        return self.path_of(best)
+
+    def virtual_purify(self, path: tuple) -> 'tuple[qu.Fidelity, qu.ExpCost]':
+        """
+        fidelity and cost of the root if the instance at path were purified
+        """
+        chain = [self.root]
+        for step in path:
+            chain.append(chain[-1].left if step == 0 else chain[-1].right)
+
+        node = chain[-1]
+        f, p, c = self.gate.ladder.get(node.fid)
+        c = c * node.cost
+        for parent, step in zip(reversed(chain[:-1]), reversed(path)):
+            sib = parent.right if step == 0 else parent.left
+            fl, fr = (f, sib.fid) if step == 0 else (sib.fid, f)
+            cl, cr = (c, sib.cost) if step == 0 else (sib.cost, c)
+            if parent.op == qu.OpType.SWAP:
+                f, p = self.gate.swap(fl, fr)
+            else:
+                f, p = self.gate.purify(fl, fr)
+            c = (cl + cr) / p
+        return f, c
+
+    def purify(self, path: tuple) -> tuple:
+        """
+        purify the instance at path, its two copies share one subtree
+        only the ancestors on the path are rebuilt (copy on write)
+        return the path of the new PURIFY branch
+        """
+        chain = [self.root]
+        for step in path:
+            chain.append(chain[-1].left if step == 0 else chain[-1].right)
+
+        new = self.branch(qu.OpType.PURIFY, chain[-1], chain[-1])
+        for parent, step in zip(reversed(chain[:-1]), reversed(path)):
+            if step == 0:
+                new = self.branch(parent.op, new, parent.right)
+            else:
+                new = self.branch(parent.op, parent.left, new)
+        self.root = new
+        return path
+
+    def to_tree(self, node: SharedNode=None) -> TreeNode:
+        """
+        expand into an unshared TreeNode tree
+        """
+        if node is None:
+            node = self.root
+        # post-order, a shared subtree is expanded once per instance
+        done: 'list[TreeNode]' = []
+        stack = [(node, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if node.is_leaf():
+                tnode = Leaf(node.edge_tuple, node.fid, None)
+                tnode.cost = node.cost
+                done.append(tnode)
+            elif not expanded:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+            else:
+                rc = done.pop()
+                lc = done.pop()
+                tnode = Branch(node.edge_tuple, node.fid, None, lc, rc, node.op, node.prob)
+                lc.parent = rc.parent = tnode
+                done.append(tnode)
+        return done[0]
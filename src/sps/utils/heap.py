@@ -0,0 +1,122 @@
+
+
+import math
+
+
+class IndexedMaxHeap:
+    """
+    Binary max-heap with an index from item to its heap position
+    so the key of any item can be changed or removed in O(log n)
+    items are indexed by identity, NaN keys sort as -inf
+    """
+
+    def __init__(self) -> None:
+        self._items: list = []
+        self._keys: 'list[float]' = []
+        # id(item) -> position in the heap
+        self._pos: 'dict[int, int]' = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item) -> bool:
+        return id(item) in self._pos
+
+    def push(self, item, key: float) -> None:
+        """
+        insert item, or update its key if it is already in the heap
+        """
+        if math.isnan(key):
+            key = -math.inf
+        idx = self._pos.get(id(item))
+        if idx is None:
+            self._items.append(item)
+            self._keys.append(key)
+            self._pos[id(item)] = len(self._items) - 1
+            self._sift_up(len(self._items) - 1)
+        else:
+            old = self._keys[idx]
+            self._keys[idx] = key
+            if key > old:
+                self._sift_up(idx)
+            elif key < old:
+                self._sift_down(idx)
+
+    update = push
+
+    def remove(self, item) -> None:
+        idx = self._pos.pop(id(item))
+        last = len(self._items) - 1
+        if idx != last:
+            self._move(last, idx)
+        self._items.pop()
+        self._keys.pop()
+        if idx != last:
+            self._sift_up(idx)
+            self._sift_down(idx)
+
+    def peek(self) -> 'tuple[object, float]':
+        if len(self._items) == 0:
+            return None, None
+        return self._items[0], self._keys[0]
+
+    def pop(self) -> 'tuple[object, float]':
+        item, key = self.peek()
+        if item is not None:
+            self.remove(item)
+        return item, key
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._keys.clear()
+        self._pos.clear()
+
+    def _move(self, src: int, dst: int) -> None:
+        self._items[dst] = self._items[src]
+        self._keys[dst] = self._keys[src]
+        self._pos[id(self._items[dst])] = dst
+
+    def _swap(self, i: int, j: int) -> None:
+        self._items[i], self._items[j] = self._items[j], self._items[i]
+        self._keys[i], self._keys[j] = self._keys[j], self._keys[i]
+        self._pos[id(self._items[i])] = i
+        self._pos[id(self._items[j])] = j
+
+    def _sift_up(self, idx: int) -> None:
+        keys = self._keys
+        while idx > 0:
+            parent = (idx - 1) // 2
+            if keys[idx] <= keys[parent]:
+                break
+            self._swap(idx, parent)
+            idx = parent
+
+    def _sift_down(self, idx: int) -> None:
+        keys = self._keys
+        n = len(keys)
+        while True:
+            largest = idx
+            for child in (2*idx + 1, 2*idx + 2):
+                if child < n and keys[child] > keys[largest]:
+                    largest = child
+            if largest == idx:
+                break
+            self._swap(idx, largest)
+            idx = largest
+
+
+class NodeHeap(IndexedMaxHeap):
+    """
+    Max-heap of tree nodes keyed by one of their attributes
+    only nodes of the types in search_range are kept
+    """
+
+    def __init__(self, attr: str="adjust_eff", search_range: 'list[type]'=None) -> None:
+        super().__init__()
+        self.attr = attr
+        self.search_range = tuple(search_range) if search_range is not None else (object,)
+
+    def refresh(self, node) -> None:
+        # (re)insert node with its current attr value
+        if node is not None and isinstance(node, self.search_range):
+            self.push(node, getattr(node, self.attr))
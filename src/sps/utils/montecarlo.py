@@ -0,0 +1,254 @@
+
+# Monte Carlo execution of a SPST schedule
+# every swap & purification consumes two input pairs and is retried from
+# scratch until it succeeds
+# without a gate an operation succeeds with the prob of its Branch,
+# with one every pair is sampled error free or not (leaves by their fid)
+# and the outcome of each operation is drawn from the states of its inputs,
+# so the delivered fid is measured, not taken from the tree
+
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from ...physical import quantum as qu
+from .tree import TreeNode
+from .types import OP_LEAF
+
+
+class FlatTree:
+    """
+    Pre-order arrays of a tree, cheap to pickle to worker processes
+    """
+
+    def __init__(self, root: TreeNode) -> None:
+        # pre-order with an explicit stack, deep LINKED trees are fine
+        order: 'list[TreeNode]' = []
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            order.append(node)
+            if not node.is_leaf():
+                stack.append(node.right)
+                stack.append(node.left)
+        index = {id(node): i for i, node in enumerate(order)}
+
+        n = len(order)
+        self.op = np.full(n, OP_LEAF, dtype=np.int8)
+        self.left = np.full(n, -1, dtype=np.int64)
+        self.right = np.full(n, -1, dtype=np.int64)
+        self.prob = np.ones(n)
+        self.cost = np.array([node.cost for node in order], dtype=float)
+        self.fids = np.array([node.fid for node in order], dtype=float)
+        for i, node in enumerate(order):
+            if not node.is_leaf():
+                self.op[i] = node.op.value
+                self.prob[i] = node.prob
+                self.left[i] = index[id(node.left)]
+                self.right[i] = index[id(node.right)]
+
+        self.fid = root.fid
+        self.exp_cost = root.cost
+        # expected number of leaf pairs drawn per delivered root pair
+        demand = np.ones(n)
+        for i in reversed(range(n)):
+            if self.op[i] != OP_LEAF:
+                demand[i] = (demand[self.left[i]] + demand[self.right[i]]) / self.prob[i]
+        self.exp_demand = demand[0]
+
+
+def _attempts(k: int, prob: float) -> int:
+    # attempts that yield k successes but for a ~1e-9 chance
+    if prob >= 1:
+        return k
+    return int(np.ceil(k / prob + 6 * np.sqrt(k * (1 - prob)) / prob + 6 / prob))
+
+
+def _outcome(tree: FlatTree, i: int, gate: 'qu.Gate', left_ok: np.ndarray,
+        right_ok: np.ndarray, rng: np.random.Generator) -> 'tuple[np.ndarray, np.ndarray]':
+    """
+    success & error free output of every attempt of node i
+    inputs are error free or not, errors are twirled (werner) or Z (dephased)
+    gate None: success with Branch.prob, no output states
+    """
+    m = len(left_ok)
+    if gate is None:
+        return rng.random(m) < tree.prob[i], None
+
+    u = rng.random(m)
+    if tree.op[i] == qu.OpType.SWAP.value:
+        success = u < gate.hw.prob_swap
+        if gate.ent_type == qu.EntType.DEPHASED:
+            # Z errors cancel in pairs
+            return success, left_ok == right_ok
+        # two random paulis cancel 1 time in 3, then the swap noise:
+        # werner parameter scaled by lam = p (4 eta^2 - 1) / 3
+        ok = (left_ok & right_ok) | (~left_ok & ~right_ok & (rng.random(m) < 1/3))
+        lam = 4 * 3 * gate._swap_w
+        keep = np.where(ok, (1 + 3*lam) / 4, (1 - lam) / 4)
+        return success, rng.random(m) < keep
+
+    if gate.ent_type == qu.EntType.DEPHASED:
+        # parity check passes iff both or neither have the error
+        return left_ok == right_ok, left_ok
+    # noisy BBPSSW on twirled inputs, by number of error free inputs:
+    # success p^2 D + (1-p^2)/2, success & error free p^2 N + (1-p^2)/8
+    eta_m, eta_c, p2 = gate._eta_m, gate._eta_c, gate._p2
+    D = np.array([(5*eta_m + 4*eta_c) / 9, (eta_m + 2*eta_c) / 3, eta_m])
+    N = np.array([eta_m / 9, eta_c / 3, eta_m])
+    c = left_ok.astype(np.int64) + right_ok
+    p_success = p2 * D[c] + (1 - p2) / 2
+    p_ok = p2 * N[c] + (1 - p2) / 8
+    success = u < p_success
+    return success, rng.random(m) * p_success < p_ok
+
+
+def _produce(tree: FlatTree, node: int, k: int, gate: 'qu.Gate',
+        rng: np.random.Generator) -> 'tuple[np.ndarray, np.ndarray]':
+    """
+    deliver k pairs at node, return the cost & error free state of each
+    every branch draws enough attempts up front (its children deliver them
+    all), a delivery consumes the attempts up to & including its success,
+    unused attempts are dropped and a shortfall is delivered by another call
+    """
+    # top-down: number of pairs asked of every node of the subtree
+    asked = {node: k}
+    order = [node]
+    for i in order:
+        if tree.op[i] != OP_LEAF:
+            m = _attempts(asked[i], tree.prob[i])
+            asked[tree.left[i]] = asked[tree.right[i]] = m
+            order.append(tree.left[i])
+            order.append(tree.right[i])
+
+    # bottom-up: children are done before their parent
+    done: 'dict[int, tuple[np.ndarray, np.ndarray]]' = {}
+    for i in reversed(order):
+        n = asked[i]
+        if tree.op[i] == OP_LEAF:
+            ok = rng.random(n) < tree.fids[i] if gate is not None else np.ones(n, dtype=bool)
+            done[i] = (np.full(n, tree.cost[i]), ok)
+            continue
+        left_cost, left_ok = done.pop(tree.left[i])
+        right_cost, right_ok = done.pop(tree.right[i])
+        success, ok = _outcome(tree, i, gate, left_ok, right_ok, rng)
+        if ok is None:
+            ok = np.ones(len(success), dtype=bool)
+
+        # attempt t serves delivery (successes before t)
+        serves = np.cumsum(success) - success
+        used = serves < n
+        cost = np.bincount(serves[used], weights=(left_cost + right_cost)[used], minlength=n)[:n]
+        hits = np.nonzero(success)[0][:n]
+        out_ok = ok[hits]
+        if len(hits) < n:
+            # the attempts that failed at the end still count
+            more_cost, more_ok = _produce(tree, i, n - len(hits), gate, rng)
+            cost[len(hits):] += more_cost
+            out_ok = np.concatenate([out_ok, more_ok])
+        done[i] = (cost, out_ok)
+    return done[node]
+
+
+def _simulate(tree: FlatTree, trials: int, rng: np.random.Generator,
+        gate: 'qu.Gate'=None) -> 'tuple[np.ndarray, np.ndarray]':
+    """
+    simulate trials deliveries of the root pair at once
+    return the cost of each trial and whether the delivered pair is error free
+    (None without a gate)
+    """
+    costs, ok = _produce(tree, 0, trials, gate, rng)
+    return costs, ok if gate is not None else None
+
+
+def _run_shard(tree: FlatTree, trials: int, batch: int, seed: np.random.SeedSequence,
+        gate: 'qu.Gate'=None) -> 'tuple[np.ndarray, np.ndarray]':
+    rng = np.random.default_rng(seed)
+    costs, delivered = [], []
+    for start in range(0, trials, batch):
+        c, d = _simulate(tree, min(batch, trials - start), rng, gate)
+        costs.append(c)
+        delivered.append(d)
+    if gate is None:
+        return np.concatenate(costs), None
+    return np.concatenate(costs), np.concatenate(delivered)
+
+
+class MCReport:
+    """
+    Empirical cost & fidelity of a schedule vs. its analytic values
+    delivered is None when no gate was simulated, fid is then None too
+    """
+
+    def __init__(self, costs: np.ndarray, delivered: np.ndarray,
+            exp_cost: qu.ExpCost, exp_fid: qu.Fidelity) -> None:
+        self.costs = costs
+        self.delivered = delivered
+        self.trials = len(costs)
+
+        self.exp_cost = exp_cost
+        self.exp_fid = exp_fid
+
+        self.mean_cost = np.mean(costs)
+        self.cost_stderr = np.std(costs) / np.sqrt(self.trials)
+        if delivered is None:
+            self.fid, self.fid_stderr = None, None
+        else:
+            self.fid = np.mean(delivered)
+            self.fid_stderr = np.sqrt(self.fid * (1 - self.fid) / self.trials)
+
+    def cost_zscore(self) -> float:
+        # distance of the analytic cost in standard errors
+        if self.cost_stderr == 0:
+            return 0.0 if self.mean_cost == self.exp_cost else float('inf')
+        return (self.mean_cost - self.exp_cost) / self.cost_stderr
+
+    def fid_zscore(self) -> float:
+        # distance of the analytic fid in standard errors
+        if self.fid is None:
+            return None
+        if self.fid_stderr == 0:
+            return 0.0 if self.fid == self.exp_fid else float('inf')
+        return (self.fid - self.exp_fid) / self.fid_stderr
+
+    def cost_quantiles(self, qs=(0.5, 0.9, 0.99)) -> np.ndarray:
+        return np.quantile(self.costs, qs)
+
+    def __str__(self) -> str:
+        s = f'{self.trials} trials: '
+        s += f'cost={self.mean_cost:.4f}+-{self.cost_stderr:.4f} (exp {self.exp_cost:.4f})'
+        if self.fid is not None:
+            s += f', fid={self.fid:.4f}+-{self.fid_stderr:.4f} (exp {self.exp_fid:.4f})'
+        return s
+
+
+def simulate(root: TreeNode, trials: int=10**6, workers: int=1,
+        seed=None, max_demand: int=2**22, gate: 'qu.Gate'=None) -> MCReport:
+    """
+    Monte Carlo execution of the schedule rooted at root
+    trials are split into one shard per worker, each with its own rng stream,
+    and simulated in vectorized batches of at most max_demand leaf draws
+    gate: the gate the tree was built with, to sample the error of every
+    pair and check the root fid; without it only the costs are simulated
+    """
+    tree = FlatTree(root)
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, trials))
+    batch = max(1, int(max_demand / tree.exp_demand))
+
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    shards = [trials // workers + (1 if i < trials % workers else 0)
+                for i in range(workers)]
+    if workers == 1:
+        results = [_run_shard(tree, shards[0], batch, seeds[0], gate)]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_run_shard, [tree]*workers,
+                shards, [batch]*workers, seeds, [gate]*workers))
+
+    costs = np.concatenate([r[0] for r in results])
+    delivered = None if gate is None else np.concatenate([r[1] for r in results])
+    return MCReport(costs, delivered, tree.exp_cost, tree.fid)
@@ -0,0 +1,211 @@
+# binary format of SPST schedules
+# a catalog file holds many trees as columns of typed arrays:
+#   header   magic, version, number of trees, number of nodes
+#   offsets  int64 (trees + 1), nodes of tree k are offsets[k]:offsets[k+1]
+#   columns  op, left, right, edge, fid, prob, cost (one entry per node)
+# nodes of a tree are in pre-order, so the root comes first,
+# left/right are indices local to the tree, -1 for leaves
+# columns are memory-mapped on load, a tree is only read when accessed
+
+
+import io
+import struct
+
+import numpy as np
+
+from ...physical import quantum as qu
+from .tree import TreeNode, Leaf, Branch
+from .types import OP_LEAF
+
+
+MAGIC = b'SPST'
+VERSION = 1
+# magic, version, trees, nodes
+_HEADER = struct.Struct('<4sIQQ')
+_HEADER_SIZE = 64
+
+COLUMNS = (
+    ('op', np.int8, ()),
+    ('left', np.int32, ()),
+    ('right', np.int32, ()),
+    ('edge', np.int64, (2,)),
+    ('fid', np.float64, ()),
+    ('prob', np.float64, ()),
+    ('cost', np.float64, ()),
+)
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def _layout(n_trees: int, n_nodes: int) -> 'dict[str, tuple[int, np.dtype, tuple]]':
+    # byte offset, dtype & shape of the index and every column
+    layout = {}
+    offset = _HEADER_SIZE
+    layout['offsets'] = (offset, np.dtype(np.int64), (n_trees + 1,))
+    offset = _align(offset + 8 * (n_trees + 1))
+    for name, dtype, shape in COLUMNS:
+        dtype = np.dtype(dtype)
+        layout[name] = (offset, dtype, (n_nodes,) + shape)
+        offset = _align(offset + dtype.itemsize * n_nodes * int(np.prod(shape, dtype=int)))
+    return layout
+
+
+def _encode_into(root: TreeNode, cols: 'dict[str, list]') -> int:
+    # append the nodes of one tree (pre-order) to column lists
+    order: 'list[TreeNode]' = []
+    stack = [root]
+    while len(stack) > 0:
+        node = stack.pop()
+        order.append(node)
+        if not node.is_leaf():
+            stack.append(node.right)
+            stack.append(node.left)
+
+    index = {id(node): i for i, node in enumerate(order)}
+    for node in order:
+        cols['edge'].append(node.edge_tuple)
+        cols['fid'].append(node.fid)
+        cols['cost'].append(node.cost)
+        if node.is_leaf():
+            cols['op'].append(OP_LEAF)
+            cols['prob'].append(1.0)
+            cols['left'].append(-1)
+            cols['right'].append(-1)
+        else:
+            cols['op'].append(node.op.value)
+            cols['prob'].append(node.prob)
+            cols['left'].append(index[id(node.left)])
+            cols['right'].append(index[id(node.right)])
+    return len(order)
+
+
+def _to_arrays(cols: 'dict[str, list]') -> 'dict[str, np.ndarray]':
+    return {name: np.array(cols[name], dtype=dtype).reshape((-1,) + shape)
+            for name, dtype, shape in COLUMNS}
+
+
+def encode(root: TreeNode) -> 'dict[str, np.ndarray]':
+    """
+    the columns of one tree, nodes in pre-order
+    """
+    cols = {name: [] for name, _, _ in COLUMNS}
+    _encode_into(root, cols)
+    return _to_arrays(cols)
+
+
+def decode(cols: 'dict[str, np.ndarray]') -> TreeNode:
+    """
+    rebuild the TreeNode tree from the columns of one tree
+    """
+    op, left, right = np.asarray(cols['op']), np.asarray(cols['left']), np.asarray(cols['right'])
+    edge = np.asarray(cols['edge']).tolist()
+    fid, prob, cost = (np.asarray(cols[name]).tolist() for name in ('fid', 'prob', 'cost'))
+
+    nodes: 'list[TreeNode]' = [None] * len(op)
+    # children come after their parent in pre-order
+    for i in reversed(range(len(op))):
+        if op[i] == OP_LEAF:
+            node = Leaf(tuple(edge[i]), fid[i], None)
+        else:
+            lc, rc = nodes[left[i]], nodes[right[i]]
+            node = Branch(tuple(edge[i]), fid[i], None, lc, rc, qu.OpType(int(op[i])), prob[i])
+            lc.parent = rc.parent = node
+        node.cost = cost[i]
+        nodes[i] = node
+    return nodes[0]
+
+
+def write(file, roots: 'list[TreeNode]') -> None:
+    """
+    write the trees to a file name or binary file object
+    """
+    cols = {name: [] for name, _, _ in COLUMNS}
+    sizes = [_encode_into(root, cols) for root in roots]
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)
+    n_nodes = int(offsets[-1])
+    layout = _layout(len(sizes), n_nodes)
+    arrays = _to_arrays(cols)
+
+    def dump(f) -> None:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(sizes), n_nodes).ljust(_HEADER_SIZE, b'\0'))
+        written = _HEADER_SIZE
+        for name, (offset, _, _) in layout.items():
+            f.write(b'\0' * (offset - written))
+            data = offsets.tobytes() if name == 'offsets' else arrays[name].tobytes()
+            f.write(data)
+            written = offset + len(data)
+
+    if isinstance(file, (str, bytes)) or hasattr(file, '__fspath__'):
+        with open(file, 'wb') as f:
+            dump(f)
+    else:
+        dump(file)
+
+
+def to_bytes(roots: 'list[TreeNode]') -> bytes:
+    buf = io.BytesIO()
+    write(buf, roots)
+    return buf.getvalue()
+
+
+def from_bytes(data: bytes) -> 'list[TreeNode]':
+    catalog = ScheduleCatalog(data)
+    return [catalog[k] for k in range(len(catalog))]
+
+
+class ScheduleCatalog:
+    """
+    read-only view of a catalog file (or bytes)
+    a file is memory-mapped, only the trees accessed are paged in
+    """
+
+    def __init__(self, source) -> None:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._buffer = np.frombuffer(source, dtype=np.uint8)
+        else:
+            self._buffer = np.memmap(source, dtype=np.uint8, mode='r')
+
+        magic, version, n_trees, n_nodes = _HEADER.unpack_from(self._buffer[:_HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError('not a SPST catalog')
+        if version != VERSION:
+            raise ValueError(f'unsupported catalog version {version}')
+        self.n_nodes = n_nodes
+
+        self.columns: 'dict[str, np.ndarray]' = {}
+        for name, (offset, dtype, shape) in _layout(n_trees, n_nodes).items():
+            count = int(np.prod(shape, dtype=int))
+            view = self._buffer[offset:offset + count * dtype.itemsize]
+            self.columns[name] = view.view(dtype).reshape(shape)
+        self.offsets = self.columns.pop('offsets')
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def arrays(self, k: int) -> 'dict[str, np.ndarray]':
+        """
+        the columns of tree k, views into the mapped file
+        """
+        lo, hi = int(self.offsets[k]), int(self.offsets[k + 1])
+        return {name: col[lo:hi] for name, col in self.columns.items()}
+
+    def root(self, k: int) -> 'tuple[qu.Fidelity, qu.ExpCost]':
+        """
+        root (fid, cost) of tree k without decoding it
+        """
+        lo = int(self.offsets[k])
+        return float(self.columns['fid'][lo]), float(self.columns['cost'][lo])
+
+    def __getitem__(self, k: int) -> TreeNode:
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('tree index out of range')
+        return decode(self.arrays(k))
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
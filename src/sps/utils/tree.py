@@ -1,8 +1,13 @@
 
 from copy import deepcopy
+import heapq
+
+import numpy as np
 
 from ...physical import quantum as qu
 from ...physical.network import EdgeTuple
+from .heap import NodeHeap
+from .types import ExpAlloc
 
 
 class TreeNode:
@@ -37,6 +42,8 @@ class TreeNode:
         self.adjust: float = 1
         self.adjust_eff: float = 1
         self.test_rank_attr: float = 1
+        # fid, prob & cost are stale, see SPST.commit()
+        self.dirty: bool = False
 
     def is_leaf(self) -> bool:
         return self.left is None and self.right is None
@@ -94,6 +101,98 @@ class Branch(TreeNode):
         return self.op.name[0]
 
 
+class CBTree:
+    """
+    Complete binary tree in an implicit heap layout, no node objects
+    node i has children 2i+1 & 2i+2 and parent (i-1)//2,
+    leaf k is node 2**h - 1 + k, missing leaves are padding (valid False)
+    a node with only a left child passes it through (prob 1),
+    i.e. the same tree as SPST.build_sst(TreeShape.BALANCED)
+    arrays may have leading batch dimensions: fid[..., i]
+    """
+
+    def __init__(self, height: int, n_leaves: int, fid: np.ndarray, prob: np.ndarray,
+            cost: np.ndarray, valid: np.ndarray, edge: np.ndarray, op: qu.OpType) -> None:
+        self.height = height
+        self.n_leaves = n_leaves
+        self.fid = fid
+        self.prob = prob
+        self.cost = cost
+        # valid / edge are shared by the batch
+        self.valid = valid
+        self.edge = edge
+        self.op = op
+
+    def __len__(self) -> int:
+        return self.valid.shape[-1]
+
+    @staticmethod
+    def left(i):
+        return 2*i + 1
+
+    @staticmethod
+    def right(i):
+        return 2*i + 2
+
+    @staticmethod
+    def parent(i):
+        return (i - 1) // 2
+
+    @staticmethod
+    def level(l: int) -> slice:
+        # the nodes at depth l
+        return slice(2**l - 1, 2**(l + 1) - 1)
+
+    def leaves(self) -> slice:
+        return self.level(self.height)
+
+    @property
+    def root_fid(self):
+        return self.fid[..., 0]
+
+    @property
+    def root_cost(self):
+        return self.cost[..., 0]
+
+    def is_passthrough(self) -> np.ndarray:
+        # internal nodes with a left child only
+        inner = np.arange(len(self)) < 2**self.height - 1
+        idx = np.nonzero(inner)[0]
+        out = np.zeros(len(self), dtype=bool)
+        out[idx] = self.valid[2*idx + 1] & ~self.valid[2*idx + 2]
+        return out
+
+    def exp_alloc(self) -> np.ndarray:
+        """
+        expected cost of each leaf to deliver one pair at the root,
+        (..., n_leaves), see MetaTree.exp_alloc
+        """
+        scale = np.ones(self.fid.shape)
+        for l in range(self.height):
+            parents = self.level(l)
+            children = self.level(l + 1)
+            s = scale[..., parents] / self.prob[..., parents]
+            scale[..., children] = np.repeat(s, 2, axis=-1)
+        leaves = self.leaves()
+        return (self.cost[..., leaves] * scale[..., leaves])[..., :self.n_leaves]
+
+    def to_tree(self, i: int=0) -> TreeNode:
+        """
+        node objects of the subtree at i (no batch dimensions)
+        """
+        edge = tuple(self.edge[i].tolist())
+        if i >= 2**self.height - 1:
+            node = Leaf(edge, float(self.fid[i]), None)
+            node.cost = float(self.cost[i])
+            return node
+        if not self.valid[2*i + 2]:
+            return self.to_tree(2*i + 1)
+        lc, rc = self.to_tree(2*i + 1), self.to_tree(2*i + 2)
+        node = Branch(edge, float(self.fid[i]), None, lc, rc, self.op, float(self.prob[i]))
+        lc.parent = rc.parent = node
+        return node
+
+
 class MetaTree():
     
     @staticmethod
@@ -179,30 +278,157 @@ class MetaTree():
         #     return right
 
     @staticmethod
-    def build_cbt(nodes: 'list[TreeNode]', op:qu.OpType=qu.OpType.SWAP) -> TreeNode:
-        # build a complete binary tree
-        # whose leaves are the nodes in the list
-        # the order of the leaves is preserved
+    def greedy_merges(costs: 'list[qu.ExpCost]', prob: float) -> 'list[tuple[int, int]]':
+        """
+        merge order of the ST_OPT swap tree:
+        repeatedly merge the adjacent pair with min total cost
+        (the leftmost one on ties), a merged node costs (c1 + c2) / prob
+        leaves are 0..n-1, the k-th merge creates node n+k
+        return [(left, right), ...], children before parents
+        a pair cheaper than its left neighbor pair and no dearer than its
+        right one is merged by the greedy before either neighbor changes
+        (merges only raise costs), so all such pairs are merged at once
+        in array rounds; the rest runs on a heap, O(n log n)
+        """
+        cost = np.asarray(costs, dtype=float)
+        node = np.arange(len(cost))
+        lefts, rights = [], []
+        new_id = len(cost)
+        while len(cost) > 64:
+            pair = cost[:-1] + cost[1:]
+            m = len(pair)
+            # runs of equal pair costs, a run merges every other pair
+            # from its start if the start is cheaper than its left neighbor
+            starts = np.ones(m, dtype=bool)
+            starts[1:] = pair[1:] != pair[:-1]
+            run = np.maximum.accumulate(np.where(starts, np.arange(m), 0))
+            offset = np.arange(m) - run
+            local = offset % 2 == 0
+            local[run > 0] &= (pair[run - 1] > pair[run])[run > 0]
+            local[:-1] &= pair[:-1] <= pair[1:]
+            # the pair two to the left was merged, its new cost must
+            # keep this pair strictly cheaper, else the run stops here
+            bad = np.zeros(m, dtype=bool)
+            bad[2:] = local[2:] & (offset[2:] > 0) & ~(pair[:-2] / prob + cost[2:-1] > pair[2:])
+            broken = np.cumsum(bad)
+            local &= broken == broken[run] - bad[run]
+            t = np.nonzero(local)[0]
+            if len(t) < len(cost) >> 7:
+                # few pairs per round, the heap is cheaper
+                break
+            ids = np.arange(new_id, new_id + len(t))
+            new_id += len(t)
+            lefts.append(node[t])
+            rights.append(node[t + 1])
+            cost[t] = pair[t] / prob
+            node[t] = ids
+            keep = np.ones(len(cost), dtype=bool)
+            keep[t + 1] = False
+            cost, node = cost[keep], node[keep]
+
+        merges = list(zip(np.concatenate(lefts).tolist(), np.concatenate(rights).tolist())) \
+            if len(lefts) > 0 else []
+        MetaTree._heap_merges(cost.tolist(), node.tolist(), new_id, prob, merges)
+        return merges
+
+    @staticmethod
+    def _heap_merges(cost: 'list[float]', node: 'list[int]', new_id: int, prob: float,
+            merges: 'list[tuple[int, int]]') -> None:
+        # greedy merges of the live nodes, in order, appended to merges
+        n = len(cost)
+        if n < 2:
+            return
+        # live nodes form a doubly linked list of slots
+        prev = list(range(-1, n-1))
+        nxt = list(range(1, n+1))
+        nxt[-1] = -1
+
+        heap = [(cost[i] + cost[i+1], i, i+1) for i in range(n-1)]
+        heapq.heapify(heap)
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            pair_cost, i, j = heappop(heap)
+            # lazy invalidation: a merge always changes the cost of its slot,
+            # so an entry is stale iff the pair or its total cost changed
+            if nxt[i] != j or cost[i] + cost[j] != pair_cost:
+                continue
+
+            merges.append((node[i], node[j]))
+            node[i] = new_id
+            new_id += 1
+            cost[i] = pair_cost / prob
+            k = nxt[j]
+            nxt[i] = k
+            nxt[j] = -1
+            if k != -1:
+                prev[k] = i
+                heappush(heap, (cost[i] + cost[k], i, k))
+            k = prev[i]
+            if k != -1:
+                heappush(heap, (cost[k] + cost[i], k, i))
+
+    @staticmethod
+    def build_cbt(fids, gate: 'qu.Gate'=qu.GDP, costs=None,
+            edges: 'list[EdgeTuple]'=None, op: qu.OpType=qu.OpType.SWAP) -> CBTree:
+        """
+        build a complete binary tree over the leaves, order preserved
+        fids: (..., n) leaf fidelities, or a list of TreeNode
+        costs: leaf costs, broadcast against fids, 1 by default
+        edges: leaf edges, (k, k+1) for leaf k by default
+        fid, prob & cost are computed level by level with the batch gate ops
+        """
+        if len(fids) > 0 and isinstance(fids[0], TreeNode):
+            nodes: 'list[TreeNode]' = fids
+            fids = [node.fid for node in nodes]
+            costs = [node.cost for node in nodes] if costs is None else costs
+            edges = [node.edge_tuple for node in nodes] if edges is None else edges
+        fids = np.asarray(fids, dtype=float)
+        n = fids.shape[-1]
+        assert n > 0, 'no leaves'
+        costs = np.broadcast_to(np.asarray(1.0 if costs is None else costs, dtype=float),
+            fids.shape)
 
         # height of the tree
         h = 0
-        while 2 ** h < len(nodes):
+        while 2 ** h < n:
             h += 1
 
-        cbt_arrary = [None] * (2 * len(nodes) - 1)
-        # create all internal nodes
-        for i in range(len(nodes) - 1):
-            cbt_arrary[i] = Branch(None, 1, None, None, None, op, 1)
-        # number of internal nodes in the second last level
-        n = 2 ** (h - 1) - 1
-        # assign leaves from left to right of the last level of the tree
-        for i in range(len(nodes)):
-            cbt_arrary[2 ** h - 1 + i] = nodes[i]
-        
-
-
-
+        size = 2 ** (h + 1) - 1
+        batch = fids.shape[:-1]
+        fid = np.zeros(batch + (size,))
+        prob = np.ones(batch + (size,))
+        cost = np.zeros(batch + (size,))
+        valid = np.zeros(size, dtype=bool)
+        edge = np.full((size, 2), -1, dtype=np.int64)
 
+        # assign leaves from left to right of the last level of the tree
+        first = 2 ** h - 1
+        fid[..., first:first + n] = fids
+        cost[..., first:first + n] = costs
+        valid[first:first + n] = True
+        if edges is None:
+            edges = np.stack([np.arange(n), np.arange(1, n + 1)], axis=1)
+        edge[first:first + n] = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+
+        for l in range(h - 1, -1, -1):
+            lo, hi = 2 ** l - 1, 2 ** (l + 1) - 1
+            left = slice(2*lo + 1, 2*hi + 1, 2)
+            right = slice(2*lo + 2, 2*hi + 2, 2)
+            vl, vr = valid[left], valid[right]
+            if op == qu.OpType.SWAP:
+                f, p = gate.swap_batch(fid[..., left], fid[..., right])
+            else:
+                f, p = gate.purify_batch(fid[..., left], fid[..., right])
+            # only a left child: pass it through
+            fid[..., lo:hi] = np.where(vr, f, fid[..., left])
+            prob[..., lo:hi] = np.where(vr, p, 1.0)
+            c = cost[..., left] + np.where(vr, cost[..., right], 0)
+            cost[..., lo:hi] = c / prob[..., lo:hi]
+            valid[lo:hi] = vl
+            edge[lo:hi, 0] = edge[left, 0]
+            edge[lo:hi, 1] = np.where(vr, edge[right, 1], edge[left, 1])
+
+        return CBTree(h, n, fid, prob, cost, valid, edge, op)
 
     def __init__(self, leaves: 'dict[EdgeTuple, float]', op: 'qu.Gate'=qu.GDP) -> None:
         self.leaves = leaves
@@ -212,4 +438,59 @@ class MetaTree():
         self.fids = list(self.leaves.values())
 
         self.root = None
+        # set by track()
+        self.heap: NodeHeap = None
+
+    def track(self, attr: str="adjust_eff", search_range=[TreeNode]) -> NodeHeap:
+        """
+        index all nodes in search_range by attr in a max-heap
+        the tree keeps it up to date as nodes change, see max_node()
+        """
+        self.heap = NodeHeap(attr, search_range)
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node is None:
+                continue
+            self.heap.refresh(node)
+            stack.append(node.left)
+            stack.append(node.right)
+        return self.heap
+
+    def exp_alloc(self, node: TreeNode=None) -> ExpAlloc:
+        """
+        expected cost on each edge (leaf) to deliver one pair at node,
+        the costs of all edges add up to node.cost
+        """
+        if node is None:
+            node = self.root
+        alloc: ExpAlloc = {}
+        stack = [(node, 1.0)]
+        while len(stack) > 0:
+            node, scale = stack.pop()
+            if node.is_leaf():
+                alloc[node.edge_tuple] = alloc.get(node.edge_tuple, 0) + node.cost * scale
+            else:
+                stack.append((node.left, scale / node.prob))
+                stack.append((node.right, scale / node.prob))
+        return alloc
+
+    def untrack(self) -> None:
+        self.heap = None
+
+    def _reindex(self, node: TreeNode) -> None:
+        if self.heap is not None:
+            self.heap.refresh(node)
+
+    def max_node(self, attr: str="adjust_eff", search_range=[TreeNode]) -> TreeNode:
+        """
+        node with max attr in the whole tree
+        O(1) from the heap if tracked with the same attr & range,
+        otherwise a full find_max() scan
+        """
+        if self.heap is not None and self.heap.attr == attr \
+                and self.heap.search_range == tuple(search_range):
+            node, _ = self.heap.peek()
+            return node
+        return MetaTree.find_max(self.root, attr, search_range)
 
@@ -10,9 +10,17 @@ Alloc = NewType('AllocType', dict[net.EdgeTuple, qu.Cost])
 ExpAlloc = NewType('ExpAllocType', dict[net.EdgeTuple, qu.ExpCost])
 
 
+# op codes of array-backed trees: 0 for leaves, OpType values for branches
+OP_LEAF = 0
+OP_SWAP = qu.OpType.SWAP.value
+OP_PURIFY = qu.OpType.PURIFY.value
+
+
 class TreeShape(Enum):
     LINKED = 1
     FULL = 2
+    BALANCED = 2
 
     ST_OPT = 100
+    ST_DP = 101
     PT_OPT = 200